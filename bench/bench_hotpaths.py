@@ -0,0 +1,280 @@
+# bench/bench_hotpaths.py
+# Cakey – offline benchmark for the scheduling / query hot paths
+# ---------------------------------------------------------------
+# Builds a synthetic birthdays DB and runs the real logic behind
+# birthday_checker, birthday_prechecker, plan_birthdays, /birthday upcoming
+# and /birthday list against stub guilds. Nothing touches the network.
+#
+#   python bench/bench_hotpaths.py --birthdays 1000000 --guilds 10000
+#   python bench/bench_hotpaths.py --db /tmp/cakey-bench.db --reuse   # skip generation
+#
+# Reports per-phase latency, peak Python memory (tracemalloc), storage calls
+# and queued Discord API calls. Compare runs before deploying.
+import os
+import sys
+import time
+import json
+import random
+import sqlite3
+import asyncio
+import argparse
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TIMEZONES = [
+    "Europe/London", "Europe/Berlin", "Europe/Istanbul", "America/New_York", "America/Chicago",
+    "America/Los_Angeles", "America/Sao_Paulo", "Asia/Kolkata", "Asia/Tokyo", "Asia/Singapore",
+    "Australia/Sydney", "Pacific/Auckland", "Pacific/Kiritimati", "Pacific/Pago_Pago", "Africa/Lagos",
+    "UTC", None,
+]
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Offline benchmark for Cakey's hot paths")
+    ap.add_argument("--birthdays", type=int, default=100_000)
+    ap.add_argument("--guilds", type=int, default=1_000)
+    ap.add_argument("--announced-days", type=int, default=30, help="days of past bday_announced markers to generate")
+    ap.add_argument("--sample-guilds", type=int, default=200, help="guilds to run upcoming/list against")
+    ap.add_argument("--db", default=os.path.join(ROOT, "bench_cakey.db"))
+    ap.add_argument("--reuse", action="store_true", help="reuse an existing --db instead of regenerating")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="also write results as JSON to this path")
+    return ap.parse_args()
+
+
+# ---------------- SYNTHETIC DATA ----------------
+def generate(path: str, birthdays: int, guilds: int, announced_days: int, seed: int):
+    rnd = random.Random(seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    # schema comes from the bot itself (imported after this with DB_PATH=path)
+    import storage
+    storage.SQLiteStorage(path).init_db()
+
+    con = sqlite3.connect(path)
+    guild_ids = [10**17 + i * 7919 for i in range(guilds)]
+    con.executemany(
+        "INSERT INTO guild_settings (guild_id, announce_channel, birthday_role, default_timezone) VALUES (?,?,?,?)",
+        [(g, g + 1, g + 2, rnd.choice(TIMEZONES)) for g in guild_ids],
+    )
+
+    def rows():
+        for i in range(birthdays):
+            d = date(2000, 1, 1) + timedelta(days=rnd.randrange(366))
+            wish = "cake pls" if rnd.random() < 0.2 else None
+            yield (rnd.choice(guild_ids), 10**17 + i, d.day, d.month, rnd.choice(TIMEZONES), wish)
+
+    con.executemany(
+        "INSERT OR IGNORE INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, birthday_wish) VALUES (?,?,?,?,?,?)",
+        rows(),
+    )
+
+    today = date.today()
+    def markers():
+        for back in range(1, announced_days + 1):
+            d = (today - timedelta(days=back)).isoformat()
+            for _ in range(birthdays // 366):
+                yield (rnd.choice(guild_ids), 10**17 + rnd.randrange(birthdays), d)
+
+    con.executemany("INSERT OR IGNORE INTO bday_announced (guild_id, user_id, announce_date) VALUES (?,?,?)", markers())
+    con.commit()
+    con.execute("ANALYZE")
+    con.close()
+    return guild_ids
+
+
+# ---------------- STUB DISCORD OBJECTS ----------------
+class StubMember:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.display_name = f"user{user_id % 100000}"
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = None
+        self.roles = []
+
+    def __str__(self):
+        return self.display_name
+
+    async def add_roles(self, *roles, reason=None):
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        self.roles = [r for r in self.roles if r not in roles]
+
+
+class StubChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+
+    async def send(self, *args, **kwargs):
+        return None
+
+
+class StubRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class StubGuild:
+    # every user id is a member; channel/role ids match the generated settings
+    chunked = True
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self._channel = StubChannel(guild_id + 1)
+        self._role = StubRole(guild_id + 2)
+
+    def get_member(self, user_id: int):
+        return StubMember(user_id)
+
+    def get_channel(self, channel_id: int):
+        return self._channel if channel_id == self._channel.id else None
+
+    def get_role(self, role_id: int):
+        return self._role if role_id == self._role.id else None
+
+
+# ---------------- HARNESS ----------------
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.samples = []
+        self.peak_kb = 0
+        self.db_calls = 0
+        self.api_calls = 0
+
+    def result(self):
+        s = sorted(self.samples)
+        pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000 if s else 0
+        return {
+            "phase": self.name,
+            "runs": len(s),
+            "p50_ms": round(pick(0.5), 2),
+            "p95_ms": round(pick(0.95), 2),
+            "max_ms": round(s[-1] * 1000, 2) if s else 0,
+            "peak_kb": self.peak_kb,
+            "db_calls": self.db_calls,
+            "api_calls": self.api_calls,
+        }
+
+
+async def measure(phase: Phase, coro_fn, bb):
+    db_before = bb.DB_SECONDS.totals()[0]
+    api_before = bb.pipeline.queued_calls
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    out = await coro_fn()
+    phase.samples.append(time.perf_counter() - start)
+    phase.peak_kb = max(phase.peak_kb, tracemalloc.get_traced_memory()[1] // 1024)
+    phase.db_calls += bb.DB_SECONDS.totals()[0] - db_before
+    phase.api_calls += bb.pipeline.queued_calls - api_before
+    return out
+
+
+async def run(args, guild_ids):
+    import birthday_bot
+    from sendqueue import SendPipeline
+
+    class CountingPipeline(SendPipeline):
+        # records what would be sent instead of sending it
+        queued_calls = 0
+
+        def submit(self, key, steps, label: str = "send", progress=None):
+            self.queued_calls += len(steps)
+
+    birthday_bot.bot.cakey.pipeline = CountingPipeline()
+    stubs = {}
+    birthday_bot.bot.get_guild = lambda gid: stubs.setdefault(gid, StubGuild(gid))
+    await birthday_bot.store.open()
+    # the loops and commands live in the extension; loading it binds the state above
+    await birthday_bot.bot.load_extension(birthday_bot.EXTENSION)
+    bb = sys.modules[birthday_bot.EXTENSION]
+
+    phases = []
+    tracemalloc.start()
+
+    p = Phase("plan_birthdays (24h horizon)")
+    await measure(p, bb.plan_birthdays, bb)
+    phases.append(p)
+
+    p = Phase("birthday_checker (cold)")
+    await measure(p, bb.birthday_checker, bb)
+    phases.append(p)
+
+    p = Phase("birthday_checker (all deduped)")
+    for _ in range(5):
+        await measure(p, bb.birthday_checker, bb)
+    phases.append(p)
+
+    p = Phase("birthday_prechecker")
+    await measure(p, bb.birthday_prechecker.coro, bb)
+    phases.append(p)
+
+    rnd = random.Random(args.seed)
+    sample = rnd.sample(guild_ids, min(args.sample_guilds, len(guild_ids)))
+    today = date.today()
+
+    async def upcoming(gid):
+        guild = stubs.setdefault(gid, StubGuild(gid))
+        segments = bb.upcoming_segments(today, 30)
+        pages = bb.BirthdayPages(
+            guild, "upcoming", (today, 30), segments, bb.render_upcoming(today),
+            title="bench", colour=None, total=await bb.store.count_birthdays(gid, segments),
+        )
+        return await pages.fetch(pages.start)
+
+    async def list_month(gid):
+        guild = stubs.setdefault(gid, StubGuild(gid))
+        month = rnd.randint(1, 12)
+        segments = [((month, 1), (month, 31))]
+        pages = bb.BirthdayPages(
+            guild, "list", month, segments, bb.render_month,
+            title="bench", colour=None, total=await bb.store.count_birthdays(gid, segments),
+        )
+        return await pages.fetch(pages.start)
+
+    for name, fn in (("upcoming (cold)", upcoming), ("upcoming (warm)", upcoming), ("list_month (warm)", list_month)):
+        p = Phase(f"{name} x{len(sample)}")
+        for gid in sample:
+            bb.page_cache.clear()
+            await measure(p, lambda: fn(gid), bb)
+        phases.append(p)
+
+    tracemalloc.stop()
+    return [ph.result() for ph in phases]
+
+
+def main():
+    args = parse_args()
+    os.environ["DB_PATH"] = args.db
+    os.environ.setdefault("DISCORD_TOKEN", "bench")
+
+    t0 = time.perf_counter()
+    if args.reuse and os.path.exists(args.db):
+        con = sqlite3.connect(args.db)
+        guild_ids = [r[0] for r in con.execute("SELECT guild_id FROM guild_settings")]
+        con.close()
+    else:
+        guild_ids = generate(args.db, args.birthdays, args.guilds, args.announced_days, args.seed)
+    print(f"dataset ready in {time.perf_counter() - t0:.1f}s: {args.db}")
+
+    results = asyncio.run(run(args, guild_ids))
+
+    cols = ("phase", "runs", "p50_ms", "p95_ms", "max_ms", "peak_kb", "db_calls", "api_calls")
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(cols, widths)))
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"birthdays": args.birthdays, "guilds": args.guilds, "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
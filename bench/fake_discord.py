@@ -0,0 +1,456 @@
+# bench/fake_discord.py
+# Cakey – local stand-in for the Discord REST API and gateway
+# ---------------------------------------------------------------
+# Just enough of Discord for the unmodified bot (discord.py and all) to log in,
+# receive its guilds over a websocket, resolve members, send messages, add and
+# remove roles and answer slash commands, all on 127.0.0.1.
+#
+# Rate limits are answered the way Discord does it (X-RateLimit-* headers on
+# every response, 429 + retry_after when a bucket or the global limit runs
+# dry), so discord.py's own bucket handling and the bot's send pipeline are
+# what's being measured. Every request is logged for the report.
+#
+# Used by bench/load_harness.py; call FakeDiscord.patch_client() before the bot
+# logs in so discord.py talks to this instead of discord.com.
+import re
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType
+
+API_PREFIX = "/api/v10"
+DISCORD_EPOCH_MS = 1420070400000
+
+# (method, path regex, route template); the first named group is the bucket's major parameter
+ROUTES = [
+    ("GET", r"/users/@me", "/users/@me"),
+    ("GET", r"/gateway", "/gateway"),
+    ("GET", r"/gateway/bot", "/gateway/bot"),
+    ("GET", r"/oauth2/applications/@me", "/oauth2/applications/@me"),
+    ("GET", r"/applications/(?P<application_id>\d+)/commands", "/applications/{application_id}/commands"),
+    ("PUT", r"/applications/(?P<application_id>\d+)/commands", "/applications/{application_id}/commands"),
+    ("PUT", r"/applications/(?P<application_id>\d+)/guilds/(?P<guild_id>\d+)/commands", "/applications/{application_id}/guilds/{guild_id}/commands"),
+    ("POST", r"/channels/(?P<channel_id>\d+)/messages", "/channels/{channel_id}/messages"),
+    ("PUT", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)/roles/(?P<role_id>\d+)", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"),
+    ("DELETE", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)/roles/(?P<role_id>\d+)", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"),
+    ("GET", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)", "/guilds/{guild_id}/members/{user_id}"),
+    ("POST", r"/interactions/(?P<interaction_id>\d+)/(?P<token>[^/]+)/callback", "/interactions/{interaction_id}/{token}/callback"),
+    ("GET", r"/webhooks/(?P<application_id>\d+)/(?P<token>[^/]+)/messages/@original", "/webhooks/{application_id}/{token}/messages/@original"),
+    ("PATCH", r"/webhooks/(?P<application_id>\d+)/(?P<token>[^/]+)/messages/@original", "/webhooks/{application_id}/{token}/messages/@original"),
+    ("POST", r"/webhooks/(?P<application_id>\d+)/(?P<token>[^/]+)", "/webhooks/{application_id}/{token}"),
+]
+ROUTES = [(method, re.compile(pattern + r"/?$"), template) for method, pattern, template in ROUTES]
+
+# (limit, seconds) per bucket; roughly what Discord hands out to bots
+ROUTE_LIMITS = {
+    ("POST", "/channels/{channel_id}/messages"): (5, 5.0),
+    ("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"): (10, 10.0),
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"): (10, 10.0),
+    ("GET", "/guilds/{guild_id}/members/{user_id}"): (10, 10.0),
+}
+DEFAULT_LIMIT = (50, 1.0)
+GLOBAL_LIMIT = (50, 1.0)
+# interaction responses don't count against the bot's global limit
+UNLIMITED_PREFIXES = ("/interactions/", "/webhooks/")
+
+MENTION = re.compile(r"<@!?(\d+)>")
+
+
+def snowflake(ms: int, seq: int):
+    return ((ms - DISCORD_EPOCH_MS) << 22) | (seq & 0x3FFFFF)
+
+
+def json_response(data, status: int = 200, headers=None):
+    # discord.py only parses bodies whose content-type is exactly application/json (no charset)
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers, content_type="application/json")
+
+
+def iso_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Bucket:
+    """Fixed window: `limit` requests, then 429 until the window resets."""
+
+    __slots__ = ("limit", "per", "remaining", "reset_at")
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self, now: float):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def headers(self, bucket_hash: str, now: float):
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+            "X-RateLimit-Reset": f"{time.time() + (self.reset_at - now):.3f}",
+            "X-RateLimit-Reset-After": f"{max(self.reset_at - now, 0):.3f}",
+            "X-RateLimit-Bucket": bucket_hash,
+        }
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str, channel_ids, role_ids, member_ids):
+        self.id = guild_id
+        self.name = name
+        self.channel_ids = list(channel_ids)
+        self.role_ids = list(role_ids)
+        self.members = {user_id: [] for user_id in member_ids}  # user_id -> role ids
+
+
+class GatewayConn:
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+        self.seq = 0
+        self.shard = (0, 1)
+
+    async def send(self, op: int, d=None, t: str | None = None):
+        if op == 0:
+            self.seq += 1
+        await self.ws.send_str(json.dumps({"op": op, "d": d, "s": self.seq if op == 0 else None, "t": t}))
+
+
+class FakeDiscord:
+    def __init__(self, shards: int = 1, application_id: int | None = None):
+        base_ms = int(time.time() * 1000) - 86400000
+        self._ids = itertools.count(1)
+        self._ms = itertools.count(base_ms, 7)
+        self.application_id = application_id or self.new_id()
+        self.bot_user_id = self.application_id
+        self.shards = shards
+        self.guilds = {}           # guild_id -> FakeGuild
+        self.commands = []         # last synced global commands
+        self.url = None
+        self._runner = None
+        self._conns = []
+        self._buckets = {}
+        self._global = Bucket(*GLOBAL_LIMIT)
+        self._interactions = {}    # interaction id -> (sent at, future)
+        self._tokens = {}          # interaction token -> interaction id
+
+        # what the report reads
+        self.log = []              # (time, method, template, status, interaction id or None)
+        self.ratelimited = Counter()  # template or "global" -> 429s
+        self.gateway_requests = Counter()  # op name -> count (member requests etc.)
+        self.first_mention = {}    # user id -> time their mention first landed in a channel message
+        self.unhandled = Counter()
+
+    def new_id(self):
+        return snowflake(next(self._ms), next(self._ids))
+
+    # ---------------- WORLD ----------------
+    def add_guild(self, guild_id: int, name: str, channel_ids, role_ids, member_ids):
+        guild = FakeGuild(guild_id, name, channel_ids, role_ids, member_ids)
+        guild.members[self.bot_user_id] = []
+        self.guilds[guild_id] = guild
+        return guild
+
+    def user_payload(self, user_id: int):
+        return {
+            "id": str(user_id), "username": f"user{user_id % 1000000}", "discriminator": "0",
+            "global_name": None, "avatar": None, "bot": user_id == self.bot_user_id,
+        }
+
+    def member_payload(self, guild: FakeGuild, user_id: int, with_user: bool = True):
+        data = {
+            "roles": [str(r) for r in guild.members.get(user_id, [])], "joined_at": "2020-01-01T00:00:00+00:00",
+            "deaf": False, "mute": False, "flags": 0, "nick": None, "avatar": None, "pending": False,
+            "premium_since": None, "communication_disabled_until": None,
+        }
+        if with_user:
+            data["user"] = self.user_payload(user_id)
+        return data
+
+    def guild_payload(self, guild: FakeGuild):
+        roles = [{"id": str(guild.id), "name": "@everyone", "permissions": "1071698660929", "position": 0}]
+        roles += [{"id": str(r), "name": f"role{i}", "permissions": "0", "position": i + 1} for i, r in enumerate(guild.role_ids)]
+        roles.append({"id": str(guild.id + 9), "name": "Cakey", "permissions": "8", "position": len(roles)})
+        guild.members[self.bot_user_id] = [guild.id + 9]
+        for role in roles:
+            role.update(color=0, hoist=False, managed=False, mentionable=False, flags=0)
+        channels = [
+            {"id": str(c), "type": 0, "name": f"channel{i}", "position": i, "permission_overwrites": [],
+             "guild_id": str(guild.id), "nsfw": False, "parent_id": None, "topic": None,
+             "last_message_id": None, "rate_limit_per_user": 0}
+            for i, c in enumerate(guild.channel_ids)
+        ]
+        return {
+            "id": str(guild.id), "name": guild.name, "icon": None, "owner_id": str(next(iter(guild.members))),
+            "roles": roles, "emojis": [], "stickers": [], "features": [], "channels": channels, "threads": [],
+            "members": [self.member_payload(guild, u) for u in guild.members], "member_count": len(guild.members),
+            "large": len(guild.members) > 250, "voice_states": [], "presences": [], "stage_instances": [],
+            "guild_scheduled_events": [], "premium_tier": 0, "verification_level": 0,
+            "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0, "nsfw_level": 0,
+            "afk_timeout": 300, "system_channel_flags": 0, "preferred_locale": "en-US", "unavailable": False,
+            "joined_at": "2020-01-01T00:00:00+00:00", "max_members": 500000, "premium_progress_bar_enabled": False,
+        }
+
+    def shard_of(self, guild_id: int, count: int):
+        return (guild_id >> 22) % count
+
+    # ---------------- SERVER ----------------
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/gateway", self._gateway)
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self._rest)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        for conn in list(self._conns):
+            await conn.ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def patch_client(self):
+        # discord.py reads both at request / connect time
+        import yarl
+        import discord.http
+        import discord.gateway
+        discord.http.Route.BASE = self.url + API_PREFIX
+        discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(self.url.replace("http", "ws", 1) + "/gateway")
+
+    # ---------------- REST ----------------
+    def _limit(self, method: str, template: str, major: str, path: str):
+        # (allowed, headers, 429 body)
+        now = time.monotonic()
+        if not path.startswith(UNLIMITED_PREFIXES) and not self._global.take(now):
+            self.ratelimited["global"] += 1
+            retry = max(self._global.reset_at - now, 0.001)
+            return False, {"X-RateLimit-Global": "true", "X-RateLimit-Scope": "global"}, {"message": "You are being rate limited.", "retry_after": retry, "global": True}
+        key = (method, template, major)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket(*ROUTE_LIMITS.get((method, template), DEFAULT_LIMIT))
+        bucket_hash = f"{abs(hash((method, template))) & 0xFFFFFFFF:08x}"
+        if not bucket.take(now):
+            self.ratelimited[f"{method} {template}"] += 1
+            headers = bucket.headers(bucket_hash, now)
+            headers["X-RateLimit-Scope"] = "user"
+            return False, headers, {"message": "You are being rate limited.", "retry_after": max(bucket.reset_at - now, 0.001), "global": False}
+        return True, bucket.headers(bucket_hash, now), None
+
+    async def _body(self, request: web.Request):
+        if not request.can_read_body:
+            return {}
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            raw = form.get("payload_json")
+            return json.loads(raw) if raw else {}
+        raw = await request.text()
+        return json.loads(raw) if raw else {}
+
+    async def _rest(self, request: web.Request):
+        path = "/" + request.match_info["tail"]
+        for method, pattern, template in ROUTES:
+            match = pattern.match(path) if method == request.method else None
+            if match:
+                break
+        else:
+            self.unhandled[f"{request.method} {path}"] += 1
+            return json_response({"message": "fake: not implemented", "code": 0}, status=404)
+
+        params = match.groupdict()
+        major = next(iter(params.values()), "")
+        interaction_id = int(params["interaction_id"]) if "interaction_id" in params else self._tokens.get(params.get("token"))
+        ok, headers, limited = self._limit(method, template, major, path)
+        if not ok:
+            headers["Via"] = "1.1 google"  # discord.py treats a 429 without it as a Cloudflare ban
+            headers["Retry-After"] = str(max(1, int(limited["retry_after"] + 0.999)))
+            self.log.append((time.time(), method, template, 429, interaction_id))
+            return json_response(limited, status=429, headers=headers)
+
+        body = await self._body(request)
+        status, data = await self._handle(method, template, params, body)
+        self.log.append((time.time(), method, template, status, interaction_id))
+        if template == "/interactions/{interaction_id}/{token}/callback":
+            # resolved after logging so the caller's count includes this request
+            pending = self._interactions.pop(int(params["interaction_id"]), None)
+            if pending and not pending[1].done():
+                pending[1].set_result((time.perf_counter() - pending[0], body))
+        if data is None:
+            return web.Response(status=status, headers=headers)
+        return json_response(data, status=status, headers=headers)
+
+    def message_payload(self, channel_id, body):
+        return {
+            "id": str(self.new_id()), "channel_id": str(channel_id), "author": self.user_payload(self.bot_user_id),
+            "content": body.get("content") or "", "timestamp": iso_now(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": body.get("embeds") or [], "pinned": False, "type": 0, "flags": body.get("flags", 0),
+            "components": body.get("components") or [],
+        }
+
+    async def _handle(self, method: str, template: str, params, body):
+        # (status, json or None)
+        if template == "/users/@me":
+            return 200, self.user_payload(self.bot_user_id)
+        if template == "/gateway":
+            return 200, {"url": self.url.replace("http", "ws", 1) + "/gateway"}
+        if template == "/gateway/bot":
+            return 200, {
+                "url": self.url.replace("http", "ws", 1) + "/gateway", "shards": self.shards,
+                "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 16},
+            }
+        if template == "/oauth2/applications/@me":
+            return 200, {"id": str(self.application_id), "name": "cakey", "icon": None, "description": "", "bot_public": True,
+                         "bot_require_code_grant": False, "owner": self.user_payload(self.bot_user_id), "verify_key": "", "flags": 0}
+        if template.startswith("/applications/"):
+            if method == "GET":
+                return 200, self.commands
+            self.commands = [
+                dict(cmd, id=str(self.new_id()), application_id=str(self.application_id), version="1",
+                     default_member_permissions=cmd.get("default_member_permissions"), dm_permission=cmd.get("dm_permission", True))
+                for cmd in body
+            ]
+            return 200, self.commands
+        if template == "/channels/{channel_id}/messages":
+            now = time.time()
+            for user_id in MENTION.findall(json.dumps(body, ensure_ascii=False)):
+                self.first_mention.setdefault(int(user_id), now)
+            return 200, self.message_payload(params["channel_id"], body)
+        if template == "/guilds/{guild_id}/members/{user_id}/roles/{role_id}":
+            guild = self.guilds.get(int(params["guild_id"]))
+            roles = guild.members.get(int(params["user_id"])) if guild else None
+            if roles is None:
+                return 404, {"message": "Unknown Member", "code": 10007}
+            role_id = int(params["role_id"])
+            if method == "PUT" and role_id not in roles:
+                roles.append(role_id)
+            elif method == "DELETE" and role_id in roles:
+                roles.remove(role_id)
+            return 204, None
+        if template == "/guilds/{guild_id}/members/{user_id}":
+            guild = self.guilds.get(int(params["guild_id"]))
+            if not guild or int(params["user_id"]) not in guild.members:
+                return 404, {"message": "Unknown Member", "code": 10007}
+            return 200, self.member_payload(guild, int(params["user_id"]))
+        if template == "/interactions/{interaction_id}/{token}/callback":
+            return 204, None
+        if template.startswith("/webhooks/"):
+            return 200, self.message_payload(0, body)
+        return 404, {"message": "fake: not implemented", "code": 0}
+
+    # ---------------- GATEWAY ----------------
+    async def _gateway(self, request: web.Request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        conn = GatewayConn(ws)
+        self._conns.append(conn)
+        try:
+            await conn.send(10, {"heartbeat_interval": 41250})
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                op = payload.get("op")
+                if op == 1:
+                    await conn.send(11)
+                elif op == 2:
+                    await self._identify(conn, payload["d"])
+                elif op == 6:
+                    await conn.send(9, False)  # no resumes; discord.py re-identifies
+                elif op == 8:
+                    await self._request_members(conn, payload["d"])
+        finally:
+            self._conns.remove(conn)
+        return ws
+
+    async def _identify(self, conn: GatewayConn, d):
+        conn.shard = tuple(d.get("shard") or (0, 1))
+        shard_id, count = conn.shard
+        guilds = [g for g in self.guilds.values() if self.shard_of(g.id, count) == shard_id]
+        self.gateway_requests["identify"] += 1
+        await conn.send(0, {
+            "v": 10, "user": self.user_payload(self.bot_user_id), "guilds": [{"id": str(g.id), "unavailable": True} for g in guilds],
+            "session_id": f"fake-{shard_id}", "resume_gateway_url": self.url.replace("http", "ws", 1) + "/gateway",
+            "shard": [shard_id, count], "application": {"id": str(self.application_id), "flags": 0},
+            "private_channels": [], "relationships": [],
+        }, "READY")
+        for guild in guilds:
+            await conn.send(0, self.guild_payload(guild), "GUILD_CREATE")
+
+    async def _request_members(self, conn: GatewayConn, d):
+        guild = self.guilds.get(int(d["guild_id"]))
+        self.gateway_requests["request_guild_members"] += 1
+        if guild is None:
+            return
+        user_ids = [int(u) for u in d.get("user_ids") or []]
+        if user_ids:
+            found = [u for u in user_ids if u in guild.members]
+            not_found = [str(u) for u in user_ids if u not in guild.members]
+        else:
+            query = (d.get("query") or "").lower()
+            found = [u for u in guild.members if self.user_payload(u)["username"].startswith(query)]
+            not_found = []
+            if d.get("limit"):
+                found = found[:d["limit"]]
+        chunks = [found[i:i + 1000] for i in range(0, len(found), 1000)] or [[]]
+        for index, chunk in enumerate(chunks):
+            data = {
+                "guild_id": str(guild.id), "members": [self.member_payload(guild, u) for u in chunk],
+                "chunk_index": index, "chunk_count": len(chunks), "nonce": d.get("nonce"),
+            }
+            if index == 0 and not_found:
+                data["not_found"] = not_found
+            await conn.send(0, data, "GUILD_MEMBERS_CHUNK")
+
+    async def dispatch(self, event: str, data, guild_id: int | None = None):
+        for conn in self._conns:
+            if guild_id is None or self.shard_of(guild_id, conn.shard[1]) == conn.shard[0]:
+                await conn.send(0, data, event)
+
+    # ---------------- INTERACTIONS ----------------
+    async def interact(self, guild_id: int, user_id: int, command: str, options=None, focused: str | None = None, admin: bool = False, timeout: float = 30.0):
+        # sends /birthday <command> as INTERACTION_CREATE and waits for the bot's callback;
+        # returns (seconds until the callback arrived, callback body, interaction id)
+        guild = self.guilds[guild_id]
+        interaction_id = self.new_id()
+        token = f"token{interaction_id}"
+        self._tokens[token] = interaction_id
+        sub_options = []
+        for name, value in (options or {}).items():
+            option = {"name": name, "value": value, "type": 4 if isinstance(value, int) else 3}
+            if name == focused:
+                option["focused"] = True
+            sub_options.append(option)
+        member = self.member_payload(guild, user_id)
+        member["permissions"] = "8" if admin else "1071698660929"
+        payload = {
+            "id": str(interaction_id), "application_id": str(self.application_id), "type": 4 if focused else 2,
+            "token": token, "version": 1, "guild_id": str(guild_id), "channel_id": str(guild.channel_ids[0]),
+            "channel": {"id": str(guild.channel_ids[0]), "type": 0},
+            "member": member, "locale": "en-US", "guild_locale": "en-US", "entitlements": [], "app_permissions": "8",
+            "data": {
+                "id": next((c["id"] for c in self.commands if c["name"] == "birthday"), str(self.new_id())),
+                "name": "birthday", "type": 1, "guild_id": str(guild_id),
+                "options": [{"type": 1, "name": command, "options": sub_options}],
+            },
+        }
+        future = asyncio.get_running_loop().create_future()
+        self._interactions[interaction_id] = (time.perf_counter(), future)
+        await self.dispatch("INTERACTION_CREATE", payload, guild_id)
+        try:
+            elapsed, body = await asyncio.wait_for(future, timeout)
+        finally:
+            self._interactions.pop(interaction_id, None)
+        return elapsed, body, interaction_id
@@ -0,0 +1,310 @@
+# bench/load_harness.py
+# Cakey – end-to-end load test against a local fake Discord
+# ---------------------------------------------------------------
+# Runs the real bot (gateway login, leader lease, scheduler, birthday_checker,
+# announce_birthday, the send pipeline and the slash commands) against
+# bench/fake_discord.py with thousands of simulated guilds. Nothing leaves
+# 127.0.0.1.
+#
+# The bot's clock is shifted so the seeded birthdays reach local midnight
+# --lead seconds after startup; their zones are all UTC+0 on that date, so
+# they share one midnight.
+#
+#   python bench/load_harness.py --guilds 2000 --members 25 --due 400
+#   python bench/load_harness.py --guilds 5000 --due 1000 --low-memory --commands 500
+#   python bench/load_harness.py --due 1000 --reload-after 2   # reload birthdays.py mid-burst
+#
+# Reports API calls per announcement, 429s by route, latency from local
+# midnight to each member's first mention landing, and slash command latency.
+import os
+import sys
+import time
+import json
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_discord import FakeDiscord
+
+# no DST anywhere in these, so they all hit midnight together with UTC
+ZERO_OFFSET_ZONES = ["UTC", "Etc/GMT", "Africa/Abidjan", "Africa/Accra", "Africa/Dakar", "Atlantic/Reykjavik"]
+COMMANDS = ("view", "upcoming", "list", "timezone (autocomplete)", "timezone")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="End-to-end load test for Cakey against a local fake Discord")
+    ap.add_argument("--guilds", type=int, default=1000)
+    ap.add_argument("--members", type=int, default=20, help="members with a birthday per guild")
+    ap.add_argument("--due", type=int, default=300, help="members whose birthday starts at the simulated midnight")
+    ap.add_argument("--digest-share", type=float, default=0.2, help="share of guilds in digest mode")
+    ap.add_argument("--role-share", type=float, default=0.5, help="share of guilds with a birthday role")
+    ap.add_argument("--low-memory", action="store_true", help="run with LOW_MEMORY=1 (members resolved over the gateway)")
+    ap.add_argument("--shards", type=int, default=0, help="SHARD_COUNT for the bot and the fake gateway (0 = unsharded)")
+    ap.add_argument("--commands", type=int, default=200, help="slash command interactions after the announcements")
+    ap.add_argument("--command-concurrency", type=int, default=20)
+    ap.add_argument("--lead", type=float, default=20.0, help="seconds from startup to the simulated midnight")
+    ap.add_argument("--timeout", type=float, default=900.0, help="give up on announcements this long after midnight")
+    ap.add_argument("--reload-after", type=float, help="reload the birthdays extension this many seconds after midnight")
+    ap.add_argument("--db", help="SQLite path (default: a temp file)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="also write results as JSON to this path")
+    return ap.parse_args()
+
+
+# ---------------- SYNTHETIC WORLD ----------------
+def seed(args, fake: FakeDiscord, midnight: datetime):
+    rnd = random.Random(args.seed)
+    zones = [z for z in ZERO_OFFSET_ZONES if midnight.astimezone(ZoneInfo(z)).utcoffset() == timedelta(0)]
+    target = midnight.date()
+    quiet = {(target + timedelta(days=d)).timetuple().tm_yday for d in (-1, 0, 1)}
+
+    import storage
+    storage.SQLiteStorage(args.db).init_db()
+    con = sqlite3.connect(args.db)
+
+    settings, birthdays, everyone = [], [], []
+    for i in range(args.guilds):
+        guild_id = fake.new_id()
+        members = [fake.new_id() for _ in range(args.members)]
+        fake.add_guild(guild_id, f"guild{i}", [guild_id + 1], [guild_id + 2], members)
+        role = guild_id + 2 if rnd.random() < args.role_share else None
+        mode = "digest" if rnd.random() < args.digest_share else None
+        # reminders off: only announcement traffic lands in the announcement numbers
+        settings.append((guild_id, guild_id + 1, role, rnd.choice(zones), "", mode))
+        everyone += [(guild_id, m) for m in members]
+
+    due = set(rnd.sample(everyone, min(args.due, len(everyone))))
+    for guild_id, user_id in everyone:
+        if (guild_id, user_id) in due:
+            d = target
+        else:
+            while True:
+                d = datetime(2000, 1, 1) + timedelta(days=rnd.randrange(366))
+                if d.timetuple().tm_yday not in quiet:
+                    break
+        birthdays.append((guild_id, user_id, d.day, d.month, rnd.choice(zones), "cake pls" if rnd.random() < 0.2 else None))
+
+    con.executemany(
+        "INSERT INTO guild_settings (guild_id, announce_channel, birthday_role, default_timezone, reminder_days, announce_mode) VALUES (?,?,?,?,?,?)",
+        settings,
+    )
+    con.executemany(
+        "INSERT INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, birthday_wish) VALUES (?,?,?,?,?,?)",
+        birthdays,
+    )
+    con.commit()
+    con.execute("ANALYZE")
+    con.close()
+    return [user_id for _, user_id in due], everyone
+
+
+def shift_clock(ext, shift: timedelta):
+    # the extension reads "now" through its module-level datetime; everything else keeps real time.
+    # A reload imports a fresh module, so this has to be applied again after every load.
+    class ShiftedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + shift
+
+    ext.datetime = ShiftedDatetime
+
+
+# ---------------- REPORT HELPERS ----------------
+def percentiles(values):
+    s = sorted(values)
+    pick = lambda q: round(s[min(len(s) - 1, int(q * len(s)))], 3) if s else None
+    return {"n": len(s), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(s[-1], 3) if s else None}
+
+
+def print_table(title: str, cols, rows):
+    print(f"\n{title}")
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols] if rows else [len(c) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in rows:
+        print("  ".join(str(r.get(c, "")).ljust(w) for c, w in zip(cols, widths)))
+
+
+async def wait_for(predicate, timeout: float, interval: float = 0.2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+# ---------------- PHASES ----------------
+async def reload_mid_burst(bb, delay: float, shift: timedelta):
+    # what /cakey reload does, minus the owner check; the clock is shifted before the new
+    # module's scheduler task gets to run (nothing awaits between setup() and here)
+    await asyncio.sleep(delay)
+    queued = bb.pipeline.pending()
+    await bb.bot.reload_extension(bb.EXTENSION)
+    shift_clock(sys.modules[bb.EXTENSION], shift)
+    print(f"extension reloaded {delay:.1f}s after midnight with {queued} jobs queued")
+    return queued
+
+
+async def announcements(args, bb, fake: FakeDiscord, due, midnight_real: float, shift: timedelta):
+    # waits for every due member's mention, then for the send pipeline (songs etc.) to drain
+    await wait_for(lambda: time.time() >= midnight_real, args.lead + 60)
+    reload = asyncio.create_task(reload_mid_burst(bb, args.reload_after, shift)) if args.reload_after is not None else None
+    due_set = set(due)
+    landed = lambda: due_set.issubset(fake.first_mention)
+    done = await wait_for(lambda: landed() and bb.pipeline.pending() == 0 and not bb.pipeline._workers, args.timeout, 0.5)
+    end = time.time()
+    queued_at_reload = await reload if reload else None
+
+    window = [e for e in fake.log if midnight_real - 1 <= e[0] <= end and e[4] is None]
+    calls = Counter(f"{e[1]} {e[2]}" for e in window if e[3] != 429)
+    con = sqlite3.connect(args.db)
+    outbox = con.execute("SELECT kind, COUNT(*) FROM outbox GROUP BY kind").fetchall()
+    outbox_status = dict(con.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    con.close()
+    items = sum(n for _, n in outbox)
+    api_calls = sum(calls.values())
+    latency = [fake.first_mention[u] - midnight_real for u in due if u in fake.first_mention]
+    return {
+        "completed": done,
+        "due_members": len(due),
+        "landed_members": len(latency),
+        "outbox_items": dict(outbox),
+        "outbox_status": outbox_status,
+        "queued_at_reload": queued_at_reload,
+        "api_calls": api_calls,
+        "api_calls_per_member": round(api_calls / len(latency), 2) if latency else None,
+        "api_calls_per_outbox_item": round(api_calls / items, 2) if items else None,
+        "gateway_member_requests": fake.gateway_requests["request_guild_members"],
+        "calls_by_route": dict(calls.most_common()),
+        "ratelimited_429": dict(fake.ratelimited),
+        "latency_first_mention_s": percentiles(latency),
+        "drain_s": round(end - midnight_real, 2),
+    }
+
+
+async def slash_commands(args, fake: FakeDiscord, everyone):
+    rnd = random.Random(args.seed + 1)
+    sem = asyncio.Semaphore(args.command_concurrency)
+    results = {name: [] for name in COMMANDS}
+    calls = Counter()
+    failures = Counter()
+
+    async def one(i: int):
+        name = COMMANDS[i % len(COMMANDS)]
+        guild_id, user_id = rnd.choice(everyone)
+        options, focused = {}, None
+        command = name.split()[0]
+        if name == "upcoming":
+            options = {"days": 30}
+        elif name == "list":
+            options = {"month": rnd.randint(1, 12)}
+        elif name == "timezone (autocomplete)":
+            options, focused = {"timezone": rnd.choice(["new y", "lon", "kolk", "tok", "ber"])}, "timezone"
+        elif name == "timezone":
+            options = {"timezone": rnd.choice(["America/New_York", "Europe/Berlin", "Asia/Tokyo"])}
+        async with sem:
+            try:
+                elapsed, _, interaction_id = await fake.interact(guild_id, user_id, command, options, focused)
+            except asyncio.TimeoutError:
+                failures[name] += 1
+                return
+        results[name].append(elapsed * 1000)
+        calls[name] += sum(1 for e in fake.log if e[4] == interaction_id)
+
+    await asyncio.gather(*(one(i) for i in range(args.commands)))
+    rows = []
+    for name in COMMANDS:
+        p = percentiles(results[name])
+        rows.append({
+            "command": name, "runs": p["n"], "p50_ms": p["p50"], "p95_ms": p["p95"], "max_ms": p["max"],
+            "api_calls_per_run": round(calls[name] / p["n"], 2) if p["n"] else None, "timeouts": failures[name],
+        })
+    return rows
+
+
+async def run(args):
+    real_now = datetime.now(timezone.utc)
+    midnight = datetime.combine(real_now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    fake = FakeDiscord(shards=args.shards or 1)
+    t0 = time.perf_counter()
+    due, everyone = seed(args, fake, midnight)
+    print(f"seeded {args.guilds} guilds, {len(everyone)} birthdays, {len(due)} due at {midnight:%Y-%m-%d} 00:00 local in {time.perf_counter() - t0:.1f}s")
+
+    await fake.start()
+    fake.patch_client()
+
+    os.environ.update(DISCORD_TOKEN="fake-token", DB_PATH=args.db, LOW_MEMORY="1" if args.low_memory else "0", METRICS_PORT="0")
+    if args.shards:
+        os.environ["SHARD_COUNT"] = str(args.shards)
+    import birthday_bot as bb
+
+    start = time.time()
+    midnight_real = start + args.lead
+    shift = midnight - datetime.fromtimestamp(midnight_real, timezone.utc)
+    setup_hook = bb.bot.setup_hook
+
+    async def shifted_setup_hook():
+        # the extension is loaded in setup_hook; the loops only start after login
+        await setup_hook()
+        shift_clock(sys.modules[bb.EXTENSION], shift)
+
+    bb.bot.setup_hook = shifted_setup_hook
+    ext = lambda: sys.modules[bb.EXTENSION]
+
+    async with bb.bot:
+        bot_task = asyncio.create_task(bb.bot.start(bb.TOKEN))
+        try:
+            if not await wait_for(lambda: bb.bot.cakey.is_leader and ext().scheduler.horizon_end is not None and fake.commands, args.lead):
+                raise RuntimeError("bot did not log in, take the lease and sync commands before the simulated midnight; raise --lead")
+            startup = round(time.time() - start, 2)
+            print(f"bot ready in {startup}s ({len(bb.bot.guilds)} guilds); midnight in {midnight_real - time.time():.1f}s")
+
+            report = {"startup_s": startup, "announce": await announcements(args, bb, fake, due, midnight_real, shift)}
+            report["commands"] = await slash_commands(args, fake, everyone) if args.commands else []
+            report["unhandled_routes"] = dict(fake.unhandled)
+        finally:
+            await bb.bot.close()
+            bot_task.cancel()
+            if bb.bot.cakey.is_leader:
+                await bb.store.release_lease(bb.LEASE_NAME, bb.INSTANCE_ID)
+            await bb.store.aclose()
+            await fake.stop()
+    return report
+
+
+def main():
+    args = parse_args()
+    if not args.db:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="cakey-load-"), "load.db")
+    report = asyncio.run(run(args))
+
+    a = report["announce"]
+    print_table("announcements", ("metric", "value"), [
+        {"metric": k, "value": v} for k, v in a.items()
+        if k not in ("calls_by_route", "ratelimited_429", "latency_first_mention_s") and not (k == "queued_at_reload" and v is None)
+    ])
+    print_table("api calls by route (announcement window)", ("route", "calls", "429s"), [
+        {"route": route, "calls": n, "429s": a["ratelimited_429"].get(route, 0)} for route, n in a["calls_by_route"].items()
+    ] + ([{"route": "global", "calls": "", "429s": a["ratelimited_429"]["global"]}] if "global" in a["ratelimited_429"] else []))
+    lat = a["latency_first_mention_s"]
+    print_table("local midnight -> first mention landed (s)", ("n", "p50", "p95", "p99", "max"), [lat])
+    if report["commands"]:
+        print_table("slash commands", ("command", "runs", "p50_ms", "p95_ms", "max_ms", "api_calls_per_run", "timeouts"), report["commands"])
+    if report["unhandled_routes"]:
+        print("\nroutes the fake doesn't implement:", report["unhandled_routes"])
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"args": vars(args), **report}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
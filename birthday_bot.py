@@ -1,723 +1,281 @@
 # birthday_bot.py
-# Cakey – advanced birthday bot (modal + wishes + 7-day reminder)
+# Cakey – advanced birthday bot (modal + wishes + reminders)
 # ---------------------------------------------------------------
 # NOTE (for Railway):
 #   - set DISCORD_NO_VOICE before importing discord
 #   - set envs: DISCORD_TOKEN, DEFAULT_TZ, DB_PATH
+#   - or DATABASE_URL=postgresql://... to share one database between replicas
+#   - optional sharding: SHARD_COUNT (number or "auto"), SHARD_IDS ("0-3" / "0,2"),
+#     CLUSTER_COUNT (>1 spawns one process per shard range)
+#   - optional LOW_MEMORY=1: no member chunking/cache, members resolved on demand
+#   - the birthday commands and loops live in birthdays.py, a discord.py extension
+#     that can be reloaded in place: /cakey reload (bot owner) or SIGHUP
 import os
 os.environ["DISCORD_NO_VOICE"] = "1"
 
-import sqlite3
 import asyncio
-import random
-from datetime import datetime, date
-from zoneinfo import ZoneInfo
+import hashlib
+import json
+import signal
+import socket
+import subprocess
+import sys
+import types
+import uuid
 
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 
+from storage import create_storage
+from members import MemberCache
+from sendqueue import SendPipeline
+import metrics
+
 # ---------------- ENV / CONFIG ----------------
 TOKEN = os.getenv("DISCORD_TOKEN")
-if not TOKEN:
-    raise RuntimeError("Set DISCORD_TOKEN")
 
-DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Europe/London")
 DB_PATH = os.getenv("DB_PATH", "birthdays.db")
 
+def parse_shard_ids(value: str | None):
+    # "0-3" -> [0, 1, 2, 3], "0,2,5" -> [0, 2, 5]
+    if not value:
+        return None
+    ids = []
+    for part in value.split(","):
+        lo, _, hi = part.strip().partition("-")
+        ids.extend(range(int(lo), int(hi or lo) + 1))
+    return sorted(set(ids))
+
+SHARD_COUNT_ENV = os.getenv("SHARD_COUNT", "").strip().lower()
+AUTO_SHARD = SHARD_COUNT_ENV == "auto"
+SHARD_COUNT = int(SHARD_COUNT_ENV) if SHARD_COUNT_ENV.isdigit() else None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", "1"))
+if SHARD_IDS and not SHARD_COUNT:
+    raise RuntimeError("SHARD_IDS needs a numeric SHARD_COUNT")
+
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+
 INTENTS = discord.Intents.default()
 INTENTS.members = True
 INTENTS.guilds = True
 
-bot = commands.Bot(command_prefix="!", intents=INTENTS)
-
-# ---------------- DB HELPERS ----------------
-def db():
-    # make sure dir exists if path is like /data/birthdays.db
-    folder = os.path.dirname(DB_PATH)
-    if folder and not os.path.exists(folder):
-        os.makedirs(folder, exist_ok=True)
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
-
-def init_db():
-    con = db()
-    cur = con.cursor()
-    cur.executescript("""
-    PRAGMA journal_mode=WAL;
-
-    CREATE TABLE IF NOT EXISTS birthdays (
-        guild_id      INTEGER NOT NULL,
-        user_id       INTEGER NOT NULL,
-        bday_day      INTEGER NOT NULL,
-        bday_month    INTEGER NOT NULL,
-        bday_year     INTEGER,
-        timezone      TEXT,
-        show_year     INTEGER DEFAULT 0,
-        birthday_wish TEXT,
-        UNIQUE(guild_id, user_id)
-    );
-
-    CREATE TABLE IF NOT EXISTS guild_settings (
-        guild_id          INTEGER PRIMARY KEY,
-        announce_channel  INTEGER,
-        birthday_role     INTEGER,
-        announce_text     TEXT,
-        default_timezone  TEXT
-    );
-
-    CREATE TABLE IF NOT EXISTS bday_announced (
-        guild_id     INTEGER NOT NULL,
-        user_id      INTEGER NOT NULL,
-        announce_date TEXT NOT NULL,
-        PRIMARY KEY (guild_id, user_id, announce_date)
-    );
-
-    CREATE TABLE IF NOT EXISTS bday_reminded (
-        guild_id     INTEGER NOT NULL,
-        user_id      INTEGER NOT NULL,
-        remind_date  TEXT NOT NULL,
-        PRIMARY KEY (guild_id, user_id, remind_date)
-    );
-    
-    CREATE TABLE IF NOT EXISTS birthdays (
-        guild_id      INTEGER NOT NULL,
-        user_id       INTEGER NOT NULL,
-        bday_day      INTEGER NOT NULL,
-        bday_month    INTEGER NOT NULL,
-        bday_year     INTEGER,
-        timezone      TEXT,
-        show_year     INTEGER DEFAULT 0,
-        birthday_wish TEXT,
-        UNIQUE(guild_id, user_id)
-    );
-    
-    """)
-    # ensure legacy DBs get birthday_wish
-    cur.execute("PRAGMA table_info(birthdays)")
-    cols = [r[1] for r in cur.fetchall()]
-
-    if "birthday_wish" not in cols:
-        cur.execute("ALTER TABLE birthdays ADD COLUMN birthday_wish TEXT")
-
-    if "favourite_cake" not in cols:
-        cur.execute("ALTER TABLE birthdays ADD COLUMN favourite_cake TEXT")
-
-    con.commit()
-    con.close()
-
-init_db()
-
-# ---------------- CONSTANTS / BANTER ----------------
-BANTER_7DAYS = [
-    "Heads up, {user} turns legendary in 7 days. Start planning chaos. 🎉",
-    "Alert: {user}'s birthday loading… 7 days to act like you didn’t forget. ⏰",
-    "7 days till {user} expects gifts, noise and attention. Don’t flop. 💅",
-    "{user} is about to level up in 7 days – line up the edits and credits.",
-    "Countdown: 7 days till we bully-celebrate {user}'s existence. 🎂"
-]
-
-HBD_LYRICS = [
-    "🎵 Happy birthday to you…",
-    "🎵 Happy birthday to you…",
-    "🎵 Happy birthday dear {name}…",
-    "🎵 Happy birthday to youuuu! 🎂✨"
-]
-
-# ---------------- UTILS ----------------
-def get_guild_settings(guild_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT * FROM guild_settings WHERE guild_id=?", (guild_id,))
-    row = cur.fetchone()
-    con.close()
-    return row
-
-def set_guild_setting(guild_id: int, **kwargs):
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT guild_id FROM guild_settings WHERE guild_id=?", (guild_id,))
-    exists = cur.fetchone() is not None
-    if not exists:
-        cur.execute("INSERT INTO guild_settings (guild_id) VALUES (?)", (guild_id,))
-    for k, v in kwargs.items():
-        cur.execute(f"UPDATE guild_settings SET {k}=? WHERE guild_id=?", (v, guild_id))
-    con.commit()
-    con.close()
-
-def format_birthday(row):
-    # day-month only
-    return f"{row['bday_day']:02d}-{row['bday_month']:02d}"
-
-def user_local_today(tz_str: str | None):
-    try:
-        tz = ZoneInfo(tz_str) if tz_str else ZoneInfo(DEFAULT_TZ)
-    except Exception:
-        tz = ZoneInfo(DEFAULT_TZ)
-    now = datetime.now(tz)
-    return now.date(), tz
-
-def already_announced_today(guild_id: int, user_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT 1 FROM bday_announced WHERE guild_id=? AND user_id=? AND announce_date=?",
-        (guild_id, user_id, date.today().isoformat())
-    )
-    r = cur.fetchone()
-    con.close()
-    return r is not None
-
-def already_reminded(guild_id: int, user_id: int, remind_date: str):
-    con = db()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT 1 FROM bday_reminded WHERE guild_id=? AND user_id=? AND remind_date=?",
-        (guild_id, user_id, remind_date)
-    )
-    r = cur.fetchone()
-    con.close()
-    return r is not None
-
-# ---------------- SINGING ----------------
-async def sing_happy_birthday(channel: discord.TextChannel, member: discord.Member):
-    display_name = member.display_name
-    for line in HBD_LYRICS:
-        line = line.replace("{name}", display_name)
-        await channel.send(line)
-        await asyncio.sleep(1.3)
-    await channel.send(f"🎉 Drop some love for {member.mention} in here or you’re off the guestlist.😅")
-
-# ---------------- ANNOUNCE (card + role + sing) ----------------
-async def announce_birthday(guild: discord.Guild, member: discord.Member, settings_row, bday_row):
-    channel_id = settings_row["announce_channel"] if settings_row else None
-    role_id = settings_row["birthday_role"] if settings_row else None
-    text = settings_row["announce_text"] if (settings_row and settings_row["announce_text"]) else "🎂 Happy Birthday, {mention}! Have an amazing day! 🥳"
-
-    # give role for 24h
-    if role_id:
-        role = guild.get_role(role_id)
-        if role:
-            try:
-                await member.add_roles(role, reason="Birthday role")
-                async def remove_later():
-                    await asyncio.sleep(24 * 60 * 60)
-                    g = bot.get_guild(guild.id)
-                    if not g:
-                        return
-                    m = g.get_member(member.id)
-                    if not m:
-                        return
-                    r = g.get_role(role_id)
-                    if r and r in m.roles:
-                        await m.remove_roles(r, reason="Birthday over")
-                bot.loop.create_task(remove_later())
-            except discord.Forbidden:
-                pass
-
-    # send card
-    if channel_id:
-        channel = guild.get_channel(channel_id)
-        if channel:
-            bday_str = format_birthday(bday_row)
-            msg = (
-                text.replace("{mention}", member.mention)
-                    .replace("{user}", str(member))
-                    .replace("{date}", bday_str)
-            )
-
-            embed = discord.Embed(
-                title="🎂 Birthday Card",
-                description=msg,
-                colour=discord.Colour.magenta()
-            )
-            embed.add_field(name="Birthday", value=bday_str, inline=True)
-
-            # if they had a wish, add it
-            if bday_row["birthday_wish"]:
-                embed.add_field(name="Wish", value=bday_row["birthday_wish"][:200], inline=False)
-
-            if member.display_avatar:
-                embed.set_author(name=member.display_name, icon_url=member.display_avatar.url)
-                embed.set_thumbnail(url=member.display_avatar.url)
-            else:
-                embed.set_author(name=member.display_name)
-
-            embed.set_footer(text="Have the best one. 💜")
-
-            await channel.send(embed=embed)
-
-            # sing in chat
-            try:
-                await sing_happy_birthday(channel, member)
-            except Exception as e:
-                print("Error singing birthday:", e)
-
-    # log announce
-    con = db()
-    cur = con.cursor()
-    cur.execute(
-        "INSERT OR IGNORE INTO bday_announced (guild_id, user_id, announce_date) VALUES (?,?,?)",
-        (guild.id, member.id, date.today().isoformat())
-    )
-    con.commit()
-    con.close()
-
-# ---------------- TASK: CHECK TODAY BIRTHDAYS ----------------
-@tasks.loop(minutes=5)
-async def birthday_checker():
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT * FROM birthdays")
-    all_bdays = cur.fetchall()
-    con.close()
-
-    # group by guild
-    guild_map = {}
-    for row in all_bdays:
-        guild_map.setdefault(row["guild_id"], []).append(row)
-
-    for guild_id, rows in guild_map.items():
-        guild = bot.get_guild(guild_id)
-        if not guild:
-            continue
-        settings_row = get_guild_settings(guild_id)
-
-        for row in rows:
-            user_tz = row["timezone"] or (settings_row["default_timezone"] if settings_row and settings_row["default_timezone"] else DEFAULT_TZ)
-            today_local, _ = user_local_today(user_tz)
-            if today_local.day == row["bday_day"] and today_local.month == row["bday_month"]:
-                if already_announced_today(guild_id, row["user_id"]):
-                    continue
-                member = guild.get_member(row["user_id"])
-                if not member:
-                    continue
-                try:
-                    await announce_birthday(guild, member, settings_row, row)
-                except Exception as e:
-                    print("announce error:", e)
-
-@birthday_checker.before_loop
-async def before_checker():
-    await bot.wait_until_ready()
-    print("Birthday checker started.")
-
-# ---------------- TASK: 7-DAY REMINDER ----------------
-@tasks.loop(hours=24)
-async def birthday_prechecker():
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT * FROM birthdays")
-    all_bdays = cur.fetchall()
-    con.close()
-
-    today_utc = date.today().isoformat()
-
-    guild_map = {}
-    for row in all_bdays:
-        guild_map.setdefault(row["guild_id"], []).append(row)
-
-    for guild_id, rows in guild_map.items():
-        guild = bot.get_guild(guild_id)
-        if not guild:
-            continue
-        settings_row = get_guild_settings(guild_id)
-        channel_id = settings_row["announce_channel"] if settings_row else None
-        if not channel_id:
-            continue
-        channel = guild.get_channel(channel_id)
-        if not channel:
-            continue
-
-        for row in rows:
-            user_tz = row["timezone"] or (settings_row["default_timezone"] if settings_row and settings_row["default_timezone"] else DEFAULT_TZ)
-            user_today, _ = user_local_today(user_tz)
-
-            bday = date(user_today.year, row["bday_month"], row["bday_day"])
-            if bday < user_today:
-                bday = date(user_today.year + 1, row["bday_month"], row["bday_day"])
-            delta = (bday - user_today).days
-
-            if delta == 7:
-                if already_reminded(guild_id, row["user_id"], today_utc):
-                    continue
-                member = guild.get_member(row["user_id"])
-                if not member:
-                    continue
-
-                banter = random.choice(BANTER_7DAYS).replace("{user}", member.mention)
-
-                embed = discord.Embed(
-                    title="📅 7-Day Birthday Alert",
-                    description=banter,
-                    colour=discord.Colour.gold()
-                )
-                embed.add_field(name="Birthday date", value=f"{row['bday_day']:02d}-{row['bday_month']:02d}", inline=True)
-                embed.set_footer(text="Set your birthday with /birthday set")
-
-                await channel.send(embed=embed)
-
-                con2 = db()
-                cur2 = con2.cursor()
-                cur2.execute(
-                    "INSERT OR IGNORE INTO bday_reminded (guild_id, user_id, remind_date) VALUES (?,?,?)",
-                    (guild_id, row["user_id"], today_utc)
-                )
-                con2.commit()
-                con2.close()
-
-@birthday_prechecker.before_loop
-async def before_prechecker():
-    await bot.wait_until_ready()
-    print("7-day birthday prechecker started.")
+BOT_OPTIONS = {"command_prefix": "!", "intents": INTENTS}
+if LOW_MEMORY:
+    # skip startup chunking and keep no member cache; see members.py
+    BOT_OPTIONS.update(member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False)
 
+if AUTO_SHARD or SHARD_COUNT:
+    bot = commands.AutoShardedBot(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **BOT_OPTIONS)
+else:
+    bot = commands.Bot(**BOT_OPTIONS)
 
-# ---------------- COG / SLASH COMMANDS ----------------
-class BirthdayModal(discord.ui.Modal, title="Set your birthday"):
-    day = discord.ui.TextInput(label="Day (1-31)", placeholder="31", max_length=2)
-    month = discord.ui.TextInput(label="Month (1-12)", placeholder="10", max_length=2)
-    wish = discord.ui.TextInput(
-        label="Birthday wish (optional)",
-        style=discord.TextStyle.paragraph,
-        required=False,
-        max_length=200,
-    )
+member_cache = MemberCache()
 
-    def __init__(self, interaction: discord.Interaction):
-        super().__init__()
-        self.interaction = interaction
+# ---------------- DB ----------------
+# all queries go through storage.py (SQLite at DB_PATH, or Postgres via DATABASE_URL);
+# opened in setup_hook, inside the event loop
+store = create_storage(DB_PATH, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
 
-    async def on_submit(self, interaction: discord.Interaction):
-        guild = interaction.guild
-        user = interaction.user
+# ---------------- OUTBOUND ----------------
+# every channel send / role change goes through here (per-channel + global rate budgets)
+pipeline = SendPipeline()
 
-        # validate
-        try:
-            day_i = int(str(self.day.value).strip())
-            month_i = int(str(self.month.value).strip())
-            _ = datetime(2000, month_i, day_i)  # just to validate
-        except Exception:
-            return await interaction.response.send_message(
-                "❌ Day/Month invalid. Use e.g. day=31, month=10",
-                ephemeral=True,
-            )
-
-        wish_text = str(self.wish.value).strip() if self.wish.value else None
-
-        # check if user already has a birthday
-        con = db()
-        cur = con.cursor()
-        cur.execute(
-            "SELECT 1 FROM birthdays WHERE guild_id=? AND user_id=?",
-            (guild.id, user.id),
-        )
-        already = cur.fetchone()
-
-        settings_row = get_guild_settings(guild.id)
-        auto_tz = (
-            settings_row["default_timezone"]
-            if (settings_row and settings_row["default_timezone"])
-            else DEFAULT_TZ
-        )
-
-        if already:
-            con.close()
-            return await interaction.response.send_message(
-                "⚠️ You already set your birthday. Ask an admin to change it with `/birthday set_for @you`.",
-                ephemeral=True,
-            )
-
-        # insert new
-        cur.execute(
-            """
-            INSERT INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, show_year, birthday_wish)
-            VALUES (?, ?, ?, ?, ?, 0, ?)
-            """,
-            (guild.id, user.id, day_i, month_i, auto_tz, wish_text),
-        )
-        con.commit()
-        con.close()
-
-        await interaction.response.send_message(
-            f"✅ Saved **{day_i:02d}-{month_i:02d}**. Timezone: `{auto_tz}`"
-            + (f"\n📝 Wish: {wish_text}" if wish_text else ""),
-            ephemeral=True,
-        )
-
-        # funny confirmation
-        today = date.today()
-        next_bday = date(today.year, month_i, day_i)
-        if next_bday < today:
-            next_bday = date(today.year + 1, month_i, day_i)
-        days_left = (next_bday - today).days
-
-        funny_lines = [
-            f"Alright {user.mention}, I’ve scribbled **{day_i:02d}-{month_i:02d}** in frosting on my calendar 🍰 ({days_left} days to go).",
-            f"Got it {user.mention}! I’ll start pre-heating the chaos oven 🔥 — your big day’s in **{days_left} days**.",
-            f"Duly noted {user.mention}. Expect confetti, cake, and mild regret in **{days_left} days** 🎈.",
-            f"Okay {user.mention}, birthday locked in. I’ll pretend to forget until **{days_left} days** from now 😏.",
-            f"Mark my frosting-covered words, {user.mention} — **{days_left} days** till your glorious descent into more candles 🕯️.",
-            f"Calendar updated, {user.mention}. I’ll annoy everyone about you in **{days_left} days** 💅.",
-            f"Saved. {user.mention} will be officially unbearable in **{days_left} days** 😌.",
-            f"Done ✅ {user.mention}, I’ll ping the whole house in **{days_left} days** like a proud aunty.",
-            f"{user.mention} has chosen violence on **{day_i:02d}-{month_i:02d}**. Countdown: **{days_left} days** ⚔️🎂",
-            f"Your day is locked, {user.mention}. Don’t change it or I’m telling Jas. **{days_left} days** 👀",
-            f"Birthday entered. I’ll act surprised in **{days_left} days**, promise 🤭.",
-            f"Alright starboy/starbabe {user.mention}, **{days_left} days** till we shout about you in caps 💜.",
-            f"I’ve put **{day_i:02d}-{month_i:02d}** in pen, not pencil. That’s commitment, {user.mention}. **{days_left} days** 📝",
-            f"Noted, {user.mention}. I’ll be extremely dramatic about it in **{days_left} days** 🎭.",
-            f"Schedule updated 📅 → {user.mention} gets attention in **{days_left} days**. Everyone else: cope.",
-            f"OOOH okay {user.mention}, birthday princess/prince energy arriving in **{days_left} days** 👑.",
-            f"Thanks, {user.mention}. I’ll drag everyone back to the channel in **{days_left} days** 🫡.",
-            f"Copy that. {user.mention} → **{day_i:02d}-{month_i:02d}** → cake → chaos → **{days_left} days**.",
-            f"Logged. If anyone says ‘I forgot’, I’ll show them this. **{days_left} days**, {user.mention} 🧾.",
-            f"Okayyy {user.mention}, attention deposit received. Collection in **{days_left} days** 💅.",
-            f"Your birthday has been uploaded to the Cloud of Vibes ☁️ {user.mention} — **{days_left} days**.",
-            f"Reminder armed. In **{days_left} days** I will roast you lovingly, {user.mention} 🔔.",
-            f"Booked, blessed, and ready. {user.mention} is due celebration in **{days_left} days** 🙌.",
-            f"{user.mention}, I will loudly expose your birthday in **{days_left} days** like a proper Discord auntie 🫶.",
-            f"Okay but don’t act surprised when I scream about it in **{days_left} days**, {user.mention} 😌.",
-            f"Set. If the server forgets, I won’t. **{days_left} days** till {user.mention} becomes the main character ✨.",
-            f"Birthday secured 🔐 {user.mention} → **{day_i:02d}-{month_i:02d}** → I’m telling everyone in **{days_left} days**.",
-            f"Nice try hiding, {user.mention}. I caught it. **{days_left} days** till your cake day 🎂.",
-            f"Calendar says: ‘Disturb {user.mention} with love in **{days_left} days**.’ I obey calendars 📅.",
-            f"Alright then, chaos child {user.mention} — **{days_left} days** and we’re singing off-key 🎤.",
-        ]
-
-        funny_reply = random.choice(funny_lines)
-
-        await interaction.followup.send(funny_reply)
-
-
-
-class BirthdayCog(commands.Cog):
-    def __init__(self, bot):
-        self.bot = bot
-
-    group = app_commands.Group(name="birthday", description="Birthday commands")
-
-    # /birthday set -> modal
-    @group.command(name="set", description="Set your birthday")
-    async def set_birthday(self, interaction: discord.Interaction):
-        await interaction.response.send_modal(BirthdayModal(interaction))
-
-    # /birthday view
-    @group.command(name="view", description="View someone's birthday")
-    async def view_birthday(self, interaction: discord.Interaction, user: discord.Member | None = None):
-        user = user or interaction.user
-        con = db()
-        cur = con.cursor()
-        cur.execute("SELECT * FROM birthdays WHERE guild_id=? AND user_id=?", (interaction.guild_id, user.id))
-        row = cur.fetchone()
-        con.close()
-        if not row:
-            return await interaction.response.send_message("No birthday set for that user.", ephemeral=True)
-
-        bday_str = format_birthday(row)
-        tz = row["timezone"] or DEFAULT_TZ
-        embed = discord.Embed(
-            title=f"🎂 {user.display_name}'s birthday",
-            description=f"**{bday_str}**",
-            colour=discord.Colour.blurple()
-        )
-        embed.add_field(name="Timezone", value=tz)
-        if row["birthday_wish"]:
-            embed.add_field(name="Wish", value=row["birthday_wish"], inline=False)
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-
-    # /birthday upcoming
-    @group.command(name="upcoming", description="Show upcoming birthdays")
-    @app_commands.describe(days="How many days ahead to look (default 30)")
-    async def upcoming(self, interaction: discord.Interaction, days: int = 30):
-        con = db()
-        cur = con.cursor()
-        cur.execute("SELECT * FROM birthdays WHERE guild_id=?", (interaction.guild_id,))
-        rows = cur.fetchall()
-        con.close()
-
-        if not rows:
-            return await interaction.response.send_message("No birthdays saved yet.", ephemeral=True)
-
-        today = date.today()
-        upcoming_list = []
-        for r in rows:
-            bd = date(today.year, r["bday_month"], r["bday_day"])
-            if bd < today:
-                bd = date(today.year + 1, r["bday_month"], r["bday_day"])
-            delta = (bd - today).days
-            if 0 <= delta <= days:
-                upcoming_list.append((delta, r))
-
-        upcoming_list.sort(key=lambda x: x[0])
-        desc_lines = []
-        for delta, r in upcoming_list[:20]:
-            member = interaction.guild.get_member(r["user_id"])
-            name = member.mention if member else f"<@{r['user_id']}>"
-            desc_lines.append(f"**{delta}d** → {name} ({r['bday_day']:02d}-{r['bday_month']:02d})")
-
-        if not desc_lines:
-            return await interaction.response.send_message("No upcoming birthdays in that range.", ephemeral=True)
-
-        embed = discord.Embed(
-            title=f"🎉 Upcoming birthdays (next {days} days)",
-            description="\n".join(desc_lines),
-            colour=discord.Colour.green()
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-
-    # /birthday list
-    @group.command(name="list", description="List all birthdays for a month")
-    @app_commands.describe(month="Month number 1-12")
-    async def list_month(self, interaction: discord.Interaction, month: int):
-        if not (1 <= month <= 12):
-            return await interaction.response.send_message("Month must be 1-12.", ephemeral=True)
-        con = db()
-        cur = con.cursor()
-        cur.execute("SELECT * FROM birthdays WHERE guild_id=? AND bday_month=? ORDER BY bday_day", (interaction.guild_id, month))
-        rows = cur.fetchall()
-        con.close()
-        if not rows:
-            return await interaction.response.send_message("No birthdays for that month.", ephemeral=True)
-        lines = []
-        for r in rows:
-            member = interaction.guild.get_member(r["user_id"])
-            name = member.display_name if member else f"User {r['user_id']}"
-            lines.append(f"**{r['bday_day']:02d}** — {name}")
-        embed = discord.Embed(
-            title=f"📅 Birthdays in month {month}",
-            description="\n".join(lines),
-            colour=discord.Colour.orange()
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-
-    # ADMIN: /birthday channel
-    @group.command(name="channel", description="Set the birthday announce channel (admin)")
-    @app_commands.describe(channel="Channel to post birthday messages")
-    async def set_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
-        set_guild_setting(interaction.guild_id, announce_channel=channel.id)
-        await interaction.response.send_message(f"✅ Announce channel set to {channel.mention}", ephemeral=True)
-
-    # ADMIN: /birthday role
-    @group.command(name="role", description="Set the birthday role (admin)")
-    @app_commands.describe(role="Role to give on birthday for 24h")
-    async def set_role(self, interaction: discord.Interaction, role: discord.Role):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
-        set_guild_setting(interaction.guild_id, birthday_role=role.id)
-        await interaction.response.send_message(f"✅ Birthday role set to {role.mention}", ephemeral=True)
-
-    # ADMIN: /birthday message
-    @group.command(name="message", description="Set the birthday announce message (admin)")
-    @app_commands.describe(text="Use {mention}, {user}, {date}")
-    async def set_message(self, interaction: discord.Interaction, text: str):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
-        set_guild_setting(interaction.guild_id, announce_text=text)
-        await interaction.response.send_message("✅ Birthday message updated.", ephemeral=True)
-
-    # ADMIN: /birthday default_tz
-    @group.command(name="default_tz", description="Set default timezone for this guild (admin)")
-    async def set_default_tz(self, interaction: discord.Interaction, timezone: str):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
-        try:
-            _ = ZoneInfo(timezone)
-        except Exception:
-            return await interaction.response.send_message("❌ Invalid timezone.", ephemeral=True)
-        set_guild_setting(interaction.guild_id, default_timezone=timezone)
-        await interaction.response.send_message(f"✅ Default timezone set to `{timezone}`", ephemeral=True)
-
-    @group.command(name="set_for", description="(admin) Set or change someone's birthday")
-    @app_commands.describe(
-        user="Member to set the birthday for",
-        day="Day 1-31",
-        month="Month 1-12",
-        wish="Optional birthday wish from them"
-    )
-    async def set_for(self, interaction: discord.Interaction, user: discord.Member, day: int, month: int, wish: str | None = None):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server to do this.", ephemeral=True)
-
-        # validate date
-        try:
-            _ = datetime(2000, month, day)
-        except Exception:
-            return await interaction.response.send_message("❌ Invalid day/month.", ephemeral=True)
-
-        settings_row = get_guild_settings(interaction.guild_id)
-        auto_tz = settings_row["default_timezone"] if (settings_row and settings_row["default_timezone"]) else DEFAULT_TZ
-
-        con = db()
-        cur = con.cursor()
-        cur.execute("""
-            INSERT INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, show_year, birthday_wish)
-            VALUES (?, ?, ?, ?, ?, 0, ?)
-            ON CONFLICT(guild_id, user_id) DO UPDATE SET
-                bday_day=excluded.bday_day,
-                bday_month=excluded.bday_month,
-                timezone=excluded.timezone,
-                birthday_wish=COALESCE(excluded.birthday_wish, birthdays.birthday_wish)
-        """, (interaction.guild_id, user.id, day, month, auto_tz, wish))
-        con.commit()
-        con.close()
-
-        await interaction.response.send_message(
-            f"✅ Set birthday for {user.mention} → **{day:02d}-{month:02d}**",
-            ephemeral=True
-        )
-
-
-    # ADMIN: /birthday wishes
-    @group.command(name="wishes", description="(admin) View birthday wishes")
-    async def view_wishes(self, interaction: discord.Interaction):
-        if not interaction.user.guild_permissions.manage_guild:
-            return await interaction.response.send_message("You need Manage Server to view wishes.", ephemeral=True)
-        con = db()
-        cur = con.cursor()
-        cur.execute("""
-            SELECT * FROM birthdays
-            WHERE guild_id=? AND birthday_wish IS NOT NULL AND birthday_wish <> ''
-            ORDER BY bday_month, bday_day
-        """, (interaction.guild_id,))
-        rows = cur.fetchall()
-        con.close()
-
-        if not rows:
-            return await interaction.response.send_message("No wishes submitted yet 💤", ephemeral=True)
-
-        lines = []
-        for r in rows[:25]:
-            member = interaction.guild.get_member(r["user_id"])
-            name = member.display_name if member else f"User {r['user_id']}"
-            lines.append(f"**{r['bday_day']:02d}-{r['bday_month']:02d}** — {name}:\n> {r['birthday_wish'][:180]}")
-
-        embed = discord.Embed(
-            title="🎁 Birthday wishes",
-            description="\n\n".join(lines),
-            colour=discord.Colour.purple()
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+# ---------------- EXTENSION ----------------
+# Everything birthday-related is in birthdays.py. The objects above outlive a reload of
+# it (queued sends stay queued, the member cache stays warm) and are handed over here.
+EXTENSION = "birthdays"
+bot.cakey = types.SimpleNamespace(store=store, pipeline=pipeline, member_cache=member_cache, is_leader=False, outbox_claims=set())
 
+async def setup_hook():
+    # migrations + guild settings cache, then the birthday logic, before the gateway connects
+    await store.open()
+    await bot.load_extension(EXTENSION)
 
+bot.setup_hook = setup_hook
+
+def command_tree_hash() -> str:
+    # stable fingerprint of what tree.sync() would upload
+    payload = [cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()]
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
 
 async def setup_tree():
     await bot.wait_until_ready()
-    bot.tree.add_command(BirthdayCog(bot).group)
+    # global syncs are rate limited; only upload when the commands actually changed
+    meta_key = f"command_tree_hash:{bot.application_id}"
+    digest = command_tree_hash()
+    if await store.get_meta(meta_key) == digest:
+        print("Slash commands unchanged, sync skipped.")
+        return
     await bot.tree.sync()
+    await store.set_meta(meta_key, digest)
     print("Slash commands synced.")
 
+async def reload_birthdays():
+    # if the new birthdays.py fails to import or set up, discord.py keeps the old one loaded
+    # and the ExtensionError propagates
+    await bot.reload_extension(EXTENSION)
+    print(f"Extension '{EXTENSION}' reloaded.")
+    await setup_tree()
+
+cakey_group = app_commands.Group(
+    name="cakey",
+    description="Bot maintenance",
+    default_permissions=discord.Permissions(administrator=True),
+    guild_only=True,
+)
+bot.tree.add_command(cakey_group)
+
+# OWNER: /cakey reload
+@cakey_group.command(name="reload", description="(owner) Reload the birthday commands and loops without reconnecting")
+async def reload_command(interaction: discord.Interaction):
+    # restarts the logic for every guild, so server admins aren't enough
+    if not await bot.is_owner(interaction.user):
+        return await interaction.response.send_message("Only the bot owner can do this.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        await reload_birthdays()
+    except commands.ExtensionError as e:
+        return await interaction.followup.send(f"❌ Reload failed, the previous version is still running:\n`{e}`", ephemeral=True)
+    await interaction.followup.send(f"✅ Reloaded. {pipeline.pending()} queued sends carried over.", ephemeral=True)
+
+def on_sighup():
+    # deploy hook: the replica (or cluster child) reloads in place instead of restarting
+    async def reload():
+        try:
+            await reload_birthdays()
+        except commands.ExtensionError as e:
+            print("reload failed, previous version kept:", e)
+    bot.loop.create_task(reload())
+
+# ---------------- LEADER LEASE ----------------
+# Every replica serves slash commands; only the lease holder runs the announcement
+# loops. The lease lives in the database, renewed every LEASE_TTL/3 seconds; if the
+# holder dies, another replica takes over once it expires. The loops themselves are
+# in birthdays.py and follow the "leader_change" event dispatched here.
+LEASE_TTL = int(os.getenv("LEASE_TTL", "30"))
+LEASE_NAME = "loops" + (f":{SHARD_COUNT}:{','.join(map(str, SHARD_IDS))}" if SHARD_IDS else "")
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# outbox rows this process is sending stay claimed while it keeps renewing them below,
+# whether or not it still holds the lease (see birthdays.py, OUTBOX)
+OUTBOX_CLAIM_TTL = LEASE_TTL * 2
+bot.cakey.instance_id = INSTANCE_ID
+bot.cakey.claim_ttl = OUTBOX_CLAIM_TTL
+
+@tasks.loop(seconds=max(LEASE_TTL // 3, 1))
+async def lease_keeper():
+    state = bot.cakey
+    try:
+        held = await store.acquire_lease(LEASE_NAME, INSTANCE_ID, LEASE_TTL)
+    except Exception as e:
+        # can't prove we still hold it, so stop before someone else starts
+        print("lease error:", e)
+        held = False
+    if held and not state.is_leader:
+        print(f"Leader lease '{LEASE_NAME}' acquired by {INSTANCE_ID}; starting loops.")
+    elif not held and state.is_leader:
+        print(f"Leader lease '{LEASE_NAME}' lost; stopping loops.")
+    if held != state.is_leader:
+        state.is_leader = held
+        bot.dispatch("leader_change", held)
+    if state.outbox_claims:
+        try:
+            await store.renew_outbox_claims(list(state.outbox_claims), INSTANCE_ID, OUTBOX_CLAIM_TTL)
+        except Exception as e:
+            print("outbox claim renewal error:", e)
+
+@lease_keeper.before_loop
+async def before_lease_keeper():
+    await bot.wait_until_ready()
+
 # ---------------- EVENTS ----------------
+# guild and member events are handled by the cog in birthdays.py
+metrics_runner = None
+
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} ({bot.user.id})")
-    if not birthday_checker.is_running():
-        birthday_checker.start()
-    if not birthday_prechecker.is_running():
-        birthday_prechecker.start()
+    global metrics_runner
+    if not lease_keeper.is_running():
+        lease_keeper.start()
+    if metrics.METRICS_PORT and metrics_runner is None:
+        try:
+            metrics_runner = await metrics.start_http_server()
+        except OSError as e:
+            # a busy port costs us the endpoint, not the loops
+            print(f"metrics endpoint on port {metrics.METRICS_PORT} failed:", e)
     bot.loop.create_task(setup_tree())
 
 # ---------------- RUN ----------------
-bot.run(TOKEN)
+async def migrate():
+    # the cluster parent brings the schema up to date before any child opens the database, so children
+    # don't queue behind a long migration (e.g. a full VACUUM) and give up with "database is locked"
+    await store.open()
+    await store.aclose()
+
+def run_cluster(processes: int):
+    # one child per contiguous shard range; each child runs its own loops over its own guilds
+    asyncio.run(migrate())
+    per = -(-SHARD_COUNT // processes)
+    children = []
+    for start in range(0, SHARD_COUNT, per):
+        end = min(start + per, SHARD_COUNT) - 1
+        env = dict(os.environ, SHARD_IDS=f"{start}-{end}", CLUSTER_COUNT="1")
+        if metrics.METRICS_PORT:
+            # one endpoint per child: METRICS_PORT, METRICS_PORT+1, ...
+            env["METRICS_PORT"] = str(metrics.METRICS_PORT + len(children))
+        children.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        print(f"Cluster: started shards {start}-{end} (pid {children[-1].pid}).")
+    if hasattr(signal, "SIGHUP"):
+        # one SIGHUP to the parent reloads every child
+        signal.signal(signal.SIGHUP, lambda *_: [child.send_signal(signal.SIGHUP) for child in children])
+    stops = []
+
+    def stop_children(signum, frame):
+        # a redeploy stops the parent; pass it on and wait below, so no child is left announcing.
+        # A second signal kills whatever hasn't exited yet.
+        stops.append(signum)
+        for child in children:
+            if child.poll() is None and len(stops) == 1:
+                child.send_signal(signum)
+            elif child.poll() is None:
+                child.kill()
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    try:
+        codes = [child.wait() for child in children]
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+    return max(codes)
+
+async def main():
+    discord.utils.setup_logging()
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, "SIGHUP"):  # Unix; the Windows event loop has no signal handlers
+        loop.add_signal_handler(signal.SIGHUP, on_sighup)
+        # close cleanly so the finally below hands the lease over
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: loop.create_task(bot.close()))
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            if bot.cakey.is_leader:
+                # hand over straight away instead of making the next replica wait out the TTL
+                await store.release_lease(LEASE_NAME, INSTANCE_ID)
+            await store.aclose()
+
+# guarded so bench/ can import the bot without connecting
+if __name__ == "__main__":
+    if not TOKEN:
+        raise RuntimeError("Set DISCORD_TOKEN")
+    if CLUSTER_COUNT > 1 and not SHARD_IDS:
+        if not SHARD_COUNT:
+            raise RuntimeError("CLUSTER_COUNT needs a numeric SHARD_COUNT")
+        sys.exit(run_cluster(CLUSTER_COUNT))
+    asyncio.run(main())
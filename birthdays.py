@@ -0,0 +1,1707 @@
+# birthdays.py
+# Cakey – birthday commands and loops, loaded as a discord.py extension
+# ---------------------------------------------------------------
+# birthday_bot.py owns the process: gateway connection, database, send pipeline,
+# member cache and leader lease. Everything in here can be swapped for a new
+# version with bot.reload_extension("birthdays") (/cakey reload or SIGHUP, see
+# birthday_bot.py) without reconnecting, re-chunking members or re-syncing
+# commands that didn't change.
+#
+# What survives a reload:
+#   - queued announcements, reminders and role grants stay in the send pipeline
+#     and finish with the code that queued them; their outbox rows are updated as usual
+#   - pending role expiries, dedup markers and the outbox are in the database
+#   - the scheduler heap and page cache are rebuilt from the database
+import os
+import asyncio
+import bisect
+import calendar
+import csv
+import functools
+import hashlib
+import heapq
+import io
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, date, timedelta, timezone, time as dt_time
+from typing import Literal
+from zoneinfo import ZoneInfo, available_timezones
+
+import discord
+from discord.ext import commands, tasks
+from discord import app_commands
+
+from sendqueue import Step
+from storage import DB_ERRORS
+from metrics import TICK_SECONDS, ROWS_SCANNED, ROWS_MATCHED, DB_SECONDS, DISCORD_SECONDS, DISCORD_ERRORS, ANNOUNCE_CALLS, DB_RECLAIMED_BYTES
+
+# ---------------- PROCESS STATE ----------------
+# owned by birthday_bot.py and bound from bot.cakey in setup(), so a reload picks up the same objects
+bot = None
+store = None
+pipeline = None
+member_cache = None
+
+DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Europe/London")
+
+# ---------------- CONSTANTS / BANTER ----------------
+BANTER_7DAYS = [
+    "Heads up, {user} turns legendary in 7 days. Start planning chaos. 🎉",
+    "Alert: {user}'s birthday loading… 7 days to act like you didn’t forget. ⏰",
+    "7 days till {user} expects gifts, noise and attention. Don’t flop. 💅",
+    "{user} is about to level up in 7 days – line up the edits and credits.",
+    "Countdown: 7 days till we bully-celebrate {user}'s existence. 🎂"
+]
+
+BANTER_TOMORROW = [
+    "Heads up, {user}'s birthday is tomorrow. Plan accordingly. 🎉",
+    "One sleep till {user}'s birthday. Consider yourselves warned. ⏰",
+    "Countdown: {user} levels up tomorrow. 🎂",
+]
+
+BANTER_SOON = [
+    "Heads up, {user}'s birthday is {days} days away. Plan accordingly. 🎉",
+    "{days} days till {user}'s birthday. Consider yourselves warned. ⏰",
+    "Countdown: {user} levels up in {days} days. 🎂",
+]
+
+BIRTHDAY_ROLE_SECONDS = 24 * 60 * 60
+ROLE_SWEEP_BATCH = 100
+
+HBD_LYRICS = [
+    "🎵 Happy birthday to you…",
+    "🎵 Happy birthday to you…",
+    "🎵 Happy birthday dear {name}…",
+    "🎵 Happy birthday to youuuu! 🎂✨"
+]
+
+# ---------------- UTILS ----------------
+def format_birthday(row):
+    # day-month only
+    return f"{row['bday_day']:02d}-{row['bday_month']:02d}"
+
+@functools.lru_cache(maxsize=1024)
+def resolve_tz(tz_str: str | None):
+    # one ZoneInfo per distinct string for the process; bad strings are resolved (and logged) once
+    if not tz_str:
+        return ZoneInfo(DEFAULT_TZ)
+    try:
+        return ZoneInfo(tz_str)
+    except Exception:
+        print(f"Invalid timezone {tz_str!r}, falling back to {DEFAULT_TZ}.")
+        return ZoneInfo(DEFAULT_TZ)
+
+def user_local_today(tz_str: str | None):
+    tz = resolve_tz(tz_str)
+    now = datetime.now(tz)
+    return now.date(), tz
+
+# real-world UTC offsets run from -12:00 (Baker Island) to +14:00 (Kiribati)
+MIN_UTC_OFFSET = timedelta(hours=-12)
+MAX_UTC_OFFSET = timedelta(hours=14)
+
+def local_dates(now_utc: datetime | None = None, until_utc: datetime | None = None):
+    # every calendar date that is "today" somewhere between now and until (2-3 values for "right now")
+    now_utc = now_utc or datetime.now(timezone.utc)
+    d = (now_utc + MIN_UTC_OFFSET).date()
+    last = ((until_utc or now_utc) + MAX_UTC_OFFSET).date()
+    dates = []
+    while d <= last:
+        dates.append(d)
+        d += timedelta(days=1)
+    return dates
+
+def today_month_days(now_utc: datetime | None = None, until_utc: datetime | None = None):
+    pairs = []
+    for d in local_dates(now_utc, until_utc):
+        pairs.append((d.month, d.day))
+        if (d.month, d.day) == (2, 28) and not calendar.isleap(d.year):
+            pairs.append((2, 29))  # leap-day birthdays are celebrated on 28 Feb
+    return pairs
+
+def celebration_date(month: int, day: int, year: int):
+    # 29 Feb birthdays are celebrated on 28 Feb outside leap years
+    if (month, day) == (2, 29) and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return date(year, month, day)
+
+def next_birthday(month: int, day: int, today: date):
+    bday = celebration_date(month, day, today.year)
+    if bday < today:
+        bday = celebration_date(month, day, today.year + 1)
+    return bday
+
+def is_birthday_on(month: int, day: int, d: date):
+    return celebration_date(month, day, d.year) == d
+
+async def fetch_today_candidates():
+    # only rows that can possibly be due right now
+    return await store.birthdays_on(today_month_days())
+
+def guild_tz(settings_row):
+    return settings_row["default_timezone"] if settings_row and settings_row["default_timezone"] else DEFAULT_TZ
+
+def effective_tz(row, settings_row):
+    # user tz -> guild default -> global default; rows only store a zone the member picked
+    return row["timezone"] or guild_tz(settings_row)
+
+def rows_by_timezone(rows):
+    # tz string -> rows, so a tick computes each distinct timezone's local date once
+    groups = {}
+    for row in rows:
+        groups.setdefault(effective_tz(row, store.get_guild_settings(row["guild_id"])), []).append(row)
+    return groups
+
+def next_local_midnight(month: int, day: int, tz_str: str | None, now_utc: datetime | None = None):
+    # UTC instant the birthday starts in the user's timezone; "now" if it is already their birthday
+    now_utc = now_utc or datetime.now(timezone.utc)
+    tz = resolve_tz(tz_str)
+    today_local = now_utc.astimezone(tz).date()
+    if is_birthday_on(month, day, today_local):
+        return now_utc
+    d = next_birthday(month, day, today_local + timedelta(days=1))
+    return datetime(d.year, d.month, d.day, tzinfo=tz).astimezone(timezone.utc)
+
+# ---------------- TIMEZONE AUTOCOMPLETE ----------------
+# available_timezones() walks the tzdata directory, far too slow per keystroke, so
+# the names are read once at startup into a sorted list searched with bisect.
+# Every suffix starting after a "/" or "_" is a key too, so "new york" and "york"
+# both find America/New_York.
+class TimezoneIndex:
+    def __init__(self, names):
+        self._canonical = {name.lower(): name for name in names}
+        keys = set()
+        for name in names:
+            lower = name.lower()
+            for i in [0] + [i + 1 for i, c in enumerate(lower) if c in "/_"]:
+                keys.add((lower[i:], name))
+        self._keys = sorted(keys)
+
+    @classmethod
+    def build(cls):
+        return cls(available_timezones())
+
+    def __len__(self):
+        return len(self._canonical)
+
+    def canonical(self, text: str):
+        # exact zone name, any case, or None
+        return self._canonical.get(text.strip().replace(" ", "_").lower())
+
+    def search(self, text: str, limit: int = 25):
+        prefix = text.strip().replace(" ", "_").lower()
+        found = {}
+        i = bisect.bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(found) < limit:
+            key, name = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(name)
+            i += 1
+        return list(found)
+
+tz_index = None  # built in setup()
+
+def canonical_tz(text: str):
+    # zone name as tzdata spells it, or None if it isn't one
+    if tz_index is not None:
+        return tz_index.canonical(text)
+    return text.strip() if is_valid_tz(text.strip()) else None
+
+async def timezone_autocomplete(interaction: discord.Interaction, current: str):
+    if tz_index is None:
+        return []
+    if current.strip():
+        names = tz_index.search(current)
+    else:
+        # nothing typed yet: offer the guild default
+        settings_row = store.get_guild_settings(interaction.guild_id)
+        names = list(dict.fromkeys([guild_tz(settings_row), "UTC"]))
+    now = datetime.now(timezone.utc)
+    return [app_commands.Choice(name=f"{name} ({now.astimezone(resolve_tz(name)):%H:%M})", value=name) for name in names]
+
+# ---------------- DAY OF YEAR ----------------
+# 366-day calendar so 29 Feb keeps a fixed slot (60) every year
+def day_of_year(month: int, day: int):
+    return date(2000, month, day).timetuple().tm_yday
+
+# ---------------- IMPORT / EXPORT ----------------
+EXPORT_COLUMNS = ("user_id", "day", "month", "timezone", "wish")
+MAX_IMPORT_ERRORS_SHOWN = 15
+MAX_SNOWFLAKE = 2**63 - 1  # signed 64-bit, what the user_id columns hold
+
+@functools.lru_cache(maxsize=1024)
+def is_valid_tz(tz_str: str):
+    try:
+        ZoneInfo(tz_str)
+        return True
+    except Exception:
+        return False
+
+def iter_import_records(data: bytes, filename: str):
+    # (line number, record) one at a time; a JSON array is the only format parsed in one go
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    name = filename.lower()
+    if name.endswith(".csv"):
+        reader = csv.DictReader(text)
+        for rec in reader:
+            # the file line the record ends on; a quoted field can span several
+            yield reader.line_num, rec
+    elif name.endswith((".jsonl", ".ndjson")):
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_no, None
+    elif name.endswith(".json"):
+        records = json.load(text)
+        if not isinstance(records, list):
+            raise ValueError("JSON file must be a list of objects")
+        yield from enumerate(records, start=1)
+    else:
+        raise ValueError("Use a .csv, .json or .jsonl file")
+
+def parse_import_record(rec):
+    if rec is None:
+        raise ValueError("not valid JSON")
+    if not isinstance(rec, dict):
+        raise ValueError("not an object with user_id, day, month")
+    try:
+        user_id = int(str(rec.get("user_id", "")).strip())
+        day = int(str(rec.get("day", "")).strip())
+        month = int(str(rec.get("month", "")).strip())
+    except ValueError:
+        raise ValueError("user_id, day and month must be whole numbers")
+    if not 1 <= user_id <= MAX_SNOWFLAKE:
+        # would overflow the BIGINT column and fail the whole batch
+        raise ValueError(f"user_id {user_id} is not a Discord user ID")
+    try:
+        _ = datetime(2000, month, day)
+    except ValueError:
+        raise ValueError(f"invalid day/month {day}-{month}")
+    # no timezone: NULL, so the guild default applies and a zone the member picked is kept
+    tz = str(rec.get("timezone") or "").strip() or None
+    if tz and not is_valid_tz(tz):
+        raise ValueError(f"unknown timezone `{tz}`")
+    wish = str(rec.get("wish") or "").strip()[:200] or None
+    return user_id, day, month, tz, wish
+
+def parse_import(data: bytes, filename: str, guild_id: int):
+    # one streaming validation pass -> (rows ready for executemany, ["line N: reason", ...])
+    rows, errors = [], []
+    for line_no, rec in iter_import_records(data, filename):
+        try:
+            user_id, day, month, tz, wish = parse_import_record(rec)
+        except ValueError as e:
+            errors.append(f"line {line_no}: {e}")
+            continue
+        rows.append((guild_id, user_id, day, month, tz, wish))
+    return rows, errors
+
+def export_writer(fh, fmt: str):
+    # row -> file, called on the DB reader thread while the export streams
+    if fmt == "csv":
+        writer = csv.writer(fh)
+        writer.writerow(EXPORT_COLUMNS)
+        return lambda r: writer.writerow((r["user_id"], r["bday_day"], r["bday_month"], r["timezone"] or "", r["birthday_wish"] or ""))
+    def write_json(r):
+        rec = {"user_id": r["user_id"], "day": r["bday_day"], "month": r["bday_month"], "timezone": r["timezone"], "wish": r["birthday_wish"]}
+        fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return write_json
+
+# ---------------- SINGING ----------------
+def joined_names(members, limit: int = 100):
+    # "A", "A and B", "A, B and C", "A, B and 7 others" -- kept under `limit` chars
+    names = [m.display_name for m in members]
+    if len(names) == 1:
+        return names[0]
+    for shown in range(len(names) - 1, 0, -1):
+        rest = len(names) - shown
+        tail = names[shown] if rest == 1 else f"{rest} others"
+        text = f"{', '.join(names[:shown])} and {tail}"
+        if len(text) <= limit or shown == 1:
+            return text
+
+def sing_happy_birthday(members):
+    # the song as planned messages, 1.3s apart; one song for however many members
+    display_name = joined_names(members)
+    messages = [{"content": line.replace("{name}", display_name), "delay": 1.3 if i else 0.0} for i, line in enumerate(HBD_LYRICS)]
+    mentions = ""
+    for m in members:
+        if len(mentions) + len(m.mention) + 1 > 1800:  # message content caps at 2000
+            break
+        mentions += (" " if mentions else "") + m.mention
+    messages.append({"content": f"🎉 Drop some love for {mentions} in here or you’re off the guestlist.😅", "delay": 1.3})
+    return messages
+
+# ---------------- ANNOUNCE (card + role + sing) ----------------
+DEFAULT_ANNOUNCE_TEXT = "🎂 Happy Birthday, {mention}! Have an amazing day! 🥳"
+# Discord embed limits: 4096 description, 6000 per embed (and per message), 10 embeds per message
+DIGEST_DESCRIPTION_LIMIT = 4000
+DIGEST_WISH_CHARS = 100
+
+def role_step(guild: discord.Guild, member: discord.Member, role: discord.Role):
+    # give role for 24h; role_expiry_sweeper takes it back, even across restarts.
+    # Never fails the job: a member who just left mustn't cost everyone else their role
+    async def give_role():
+        try:
+            await member.add_roles(role, reason="Birthday role")
+            await store.add_role_expiry(guild.id, member.id, role.id, int(time.time()) + BIRTHDAY_ROLE_SECONDS)
+        except discord.Forbidden:
+            pass
+        except discord.HTTPException as e:
+            print(f"birthday role error ({guild.id}/{member.id}):", e)
+    return Step(give_role, op="add_roles")
+
+def announce_role(guild: discord.Guild, settings_row):
+    role_id = settings_row["birthday_role"] if settings_row else None
+    return guild.get_role(role_id) if role_id else None
+
+def announce_channel(guild: discord.Guild, settings_row):
+    channel_id = settings_row["announce_channel"] if settings_row else None
+    return guild.get_channel(channel_id) if channel_id else None
+
+def is_digest(settings_row):
+    return bool(settings_row) and settings_row.get("announce_mode") == "digest"
+
+def birthday_messages(member: discord.Member, settings_row, bday_row):
+    # card + song (the role is granted separately, see announce_birthday)
+    text = settings_row["announce_text"] if (settings_row and settings_row["announce_text"]) else DEFAULT_ANNOUNCE_TEXT
+
+    # card
+    bday_str = format_birthday(bday_row)
+    msg = (
+        text.replace("{mention}", member.mention)
+            .replace("{user}", str(member))
+            .replace("{date}", bday_str)
+    )
+
+    embed = discord.Embed(
+        title="🎂 Birthday Card",
+        description=msg,
+        colour=discord.Colour.magenta()
+    )
+    embed.add_field(name="Birthday", value=bday_str, inline=True)
+
+    # if they had a wish, add it
+    if bday_row["birthday_wish"]:
+        embed.add_field(name="Wish", value=bday_row["birthday_wish"][:200], inline=False)
+
+    if member.display_avatar:
+        embed.set_author(name=member.display_name, icon_url=member.display_avatar.url)
+        embed.set_thumbnail(url=member.display_avatar.url)
+    else:
+        embed.set_author(name=member.display_name)
+
+    embed.set_footer(text="Have the best one. 💜")
+
+    # then sing in chat
+    return [{"embed": embed.to_dict(), "delay": 0.0}, *sing_happy_birthday([member])]
+
+def digest_embeds(entries):
+    # one line per member, packed into as few embeds as the limits allow
+    embeds = []
+    lines, size = [], 0
+    for member, bday_row in entries:
+        line = f"🎂 {member.mention} — {format_birthday(bday_row)}"
+        if bday_row["birthday_wish"]:
+            wish = bday_row["birthday_wish"].replace("\n", " ")
+            line += f"\n> {wish[:DIGEST_WISH_CHARS]}{'…' if len(wish) > DIGEST_WISH_CHARS else ''}"
+        if lines and size + len(line) + 1 > DIGEST_DESCRIPTION_LIMIT:
+            embeds.append(lines)
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        embeds.append(lines)
+
+    out = []
+    for i, chunk in enumerate(embeds):
+        embed = discord.Embed(
+            title="🎂 Today's Birthdays" + (f" ({i + 1}/{len(embeds)})" if len(embeds) > 1 else ""),
+            description="\n".join(chunk),
+            colour=discord.Colour.magenta()
+        )
+        if i == len(embeds) - 1:
+            embed.set_footer(text=f"{len(entries)} birthday{'s' if len(entries) != 1 else ''} today. Have the best one. 💜")
+        out.append(embed)
+    return out
+
+def digest_messages(entries, settings_row):
+    # digest mode: every member due this tick shares one card (split only past embed limits) and one song;
+    # each embed is close to the 6000-char per-message cap, so one embed per message
+    messages = [{"embed": embed.to_dict(), "delay": 0.0} for embed in digest_embeds(entries)]
+    if settings_row.get("digest_sing") != 0:
+        messages.extend(sing_happy_birthday([member for member, _ in entries]))
+    return messages
+
+def announce_plan(guild: discord.Guild, kind: str, entries, settings_row):
+    # everything an announcement will send, rendered once and stored with its outbox row
+    channel = announce_channel(guild, settings_row)
+    role = announce_role(guild, settings_row)
+    if not channel:
+        messages = []
+    elif kind == "digest":
+        messages = digest_messages(entries, settings_row)
+    else:
+        messages = birthday_messages(entries[0][0], settings_row, entries[0][1])
+    return {"channel_id": channel.id if channel else None, "role_id": role.id if role else None, "messages": messages}
+
+def message_step(channel: discord.abc.Messageable, message):
+    kwargs = {}
+    if "content" in message:
+        kwargs["content"] = message["content"]
+    if "embed" in message:
+        kwargs["embed"] = discord.Embed.from_dict(message["embed"])
+    return Step(lambda: channel.send(**kwargs), delay=message["delay"])
+
+# ---------------- OUTBOX ----------------
+# The checker writes one outbox row per announcement (or digest) in the same transaction as
+# the dedup markers, then hands it here. The row carries its plan (channel, role and every
+# rendered message, see announce_plan) and progress is saved after every message, so after a
+# restart replay_outbox resumes at the first unsent message of that same plan, whoever has
+# left or whatever settings changed since.
+# Each row is claimed by the process sending it (bot.cakey.outbox_claims, renewed by
+# birthday_bot.lease_keeper until the row is finished), and replay only picks up rows whose
+# claim has lapsed, so nothing still sitting in some process's send pipeline is sent twice.
+OUTBOX_REPLAY_HOURS = 12   # pending items older than this are expired, not sent late
+OUTBOX_REPLAY_BATCH = 50   # replayed items in flight at once
+OUTBOX_REPLAY_INTERVAL = 60  # seconds between sweeps for rows whose sender went away
+
+def outbox_item(kind: str, guild_id: int, user_ids, day: str, plan):
+    if kind == "digest":
+        digest = hashlib.sha1(",".join(map(str, sorted(user_ids))).encode()).hexdigest()[:16]
+        dedup_key = f"digest:{guild_id}:{day}:{digest}"
+    else:
+        dedup_key = f"announce:{guild_id}:{user_ids[0]}:{day}"
+    return (dedup_key, guild_id, kind, json.dumps(list(user_ids)), day, int(time.time()), json.dumps(plan))
+
+async def announce_birthday(guild: discord.Guild, outbox_row, plan, members):
+    # members: whichever of the row's users are still here, for the role; queues whatever is
+    # left of the plan and returns straight away
+    start = outbox_row["step"]
+    channel = guild.get_channel(plan["channel_id"]) if plan["channel_id"] else None
+    if channel is None and len(plan["messages"]) > start:
+        # deleted since the row was queued
+        return await store.outbox_progress(outbox_row["id"], start, "failed")
+    steps = [message_step(channel, message) for message in plan["messages"][start:]]
+    # role grants get their own guild queue, so a big digest's card isn't held back behind them by the
+    # channel's budget; they're idempotent and not counted in `step`, so a replay just grants again
+    role = guild.get_role(plan["role_id"]) if plan["role_id"] else None
+    grants = [role_step(guild, member, role) for member in members] if role else []
+    if not steps and not grants:
+        return await store.outbox_progress(outbox_row["id"], start, "done")
+    users = len(json.loads(outbox_row["users"]))
+    for _ in range(users):
+        ANNOUNCE_CALLS.observe((len(steps) + len(grants)) / users)
+
+    claims = bot.cakey.outbox_claims
+    unfinished = {job for job, job_steps in (("send", steps), ("roles", grants)) if job_steps}
+    sent = start
+
+    async def save(status: str):
+        if status != "pending":
+            claims.discard(outbox_row["id"])
+        await store.outbox_progress(outbox_row["id"], sent, status)
+
+    async def send_progress(done: int, error):
+        nonlocal sent
+        sent = start + done
+        # on error the job stays in `unfinished`, so the role job finishing later doesn't mark it done
+        if isinstance(error, (discord.Forbidden, discord.NotFound)):
+            return await save("failed")
+        if error:
+            # 5xx, network: stays pending and unclaimed, so replay_outbox retries from `sent`
+            claims.discard(outbox_row["id"])
+            return await save("pending")
+        if done == len(steps):
+            unfinished.discard("send")
+        await save("pending" if unfinished else "done")
+
+    async def role_progress(done: int, error):
+        # grants are best effort; the row only waits for them to finish
+        if error or done == len(grants):
+            unfinished.discard("roles")
+            if not unfinished:
+                await save("done")
+
+    if steps:
+        pipeline.submit(channel.id, steps, label=outbox_row["kind"], progress=send_progress)
+    if grants:
+        pipeline.submit(("roles", guild.id), grants, label="role", progress=role_progress)
+    claims.add(outbox_row["id"])
+
+async def replay_outbox():
+    # finish announcements nobody is sending any more (an earlier process, a lease holder that
+    # died), one bounded batch at a time so a long outage doesn't turn into a burst of API calls
+    now = int(time.time())
+    expired = await store.expire_outbox(now - OUTBOX_REPLAY_HOURS * 3600)
+    replayed = 0
+    seen = set()
+    while True:
+        # a lapsed claim on a row still in our own pipeline (renewal failed) isn't a reason to send it again
+        rows = [
+            r for r in await store.pending_outbox(now - OUTBOX_REPLAY_HOURS * 3600, now, OUTBOX_REPLAY_BATCH)
+            if r["id"] not in seen and r["id"] not in bot.cakey.outbox_claims
+        ]
+        if not rows:
+            break
+        seen.update(r["id"] for r in rows)
+        for row in await store.claim_outbox([r["id"] for r in rows], bot.cakey.instance_id, bot.cakey.claim_ttl):
+            try:
+                if await replay_one(row):
+                    replayed += 1
+            except Exception as e:
+                print("outbox replay error:", e)
+        await pipeline.join()
+    if replayed or expired:
+        print(f"Outbox: replayed {replayed} announcements, expired {expired}.")
+
+async def replay_one(row):
+    guild = bot.get_guild(row["guild_id"])
+    if not guild:
+        await store.outbox_progress(row["id"], row["step"], "failed")
+        return False
+    user_ids = json.loads(row["users"])
+    members = await member_cache.resolve(guild, user_ids)
+    if row["plan"]:
+        plan = json.loads(row["plan"])
+    else:
+        # queued before plans were stored: rebuilt from today's members and settings
+        bdays = {r["user_id"]: r for r in await store.birthdays_for_users(guild.id, user_ids)}
+        entries = [(members[u], bdays[u]) for u in user_ids if u in members and u in bdays]
+        if not entries:
+            await store.outbox_progress(row["id"], row["step"], "failed")
+            return False
+        plan = announce_plan(guild, row["kind"], entries, store.get_guild_settings(guild.id))
+    await announce_birthday(guild, row, plan, [members[u] for u in user_ids if u in members])
+    return True
+
+# ---------------- SCHEDULER ----------------
+# how far ahead the scheduler keeps birthdays in memory; refilled from the index when it runs out
+SCHEDULE_HORIZON = timedelta(hours=24)
+# with a shared database, birthdays set through other replicas are picked up by replanning this often
+SHARED_REPLAN_INTERVAL = timedelta(minutes=5)
+# due birthdays the checker couldn't finish (DB error, member lookup failed) are tried again this much later
+CHECK_RETRY = timedelta(minutes=5)
+
+class BirthdayScheduler:
+    """Min-heap of (local-midnight UTC instant, guild_id, user_id), slept on until the earliest is due."""
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}  # (guild_id, user_id) -> instant; heap items not matching this are stale
+        self._wake = asyncio.Event()
+        self.horizon_end = None
+        self.replan_at = None  # shared DB only: other replicas' edits never reach our heap directly
+
+    def clear(self):
+        # lost the leader lease; the next holder (maybe us again) replans from scratch
+        self._heap.clear()
+        self._entries.clear()
+        self.horizon_end = None
+        self.replan_at = None
+
+    def schedule(self, guild_id: int, user_id: int, when: datetime | None):
+        key = (guild_id, user_id)
+        if when is None or (self.horizon_end and when > self.horizon_end):
+            # outside the planning window: the next refill picks it up
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = when
+        heapq.heappush(self._heap, (when, guild_id, user_id))
+        if self._heap[0][0] == when:
+            self._wake.set()
+
+    def unschedule(self, guild_id: int, user_id: int):
+        self._entries.pop((guild_id, user_id), None)
+
+    def _drop_stale(self):
+        while self._heap:
+            when, guild_id, user_id = self._heap[0]
+            if self._entries.get((guild_id, user_id)) == when:
+                return
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now_utc: datetime):
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now_utc:
+            _, guild_id, user_id = heapq.heappop(self._heap)
+            del self._entries[(guild_id, user_id)]
+            due.append((guild_id, user_id))
+            self._drop_stale()
+        return due
+
+    async def sleep_until_next(self):
+        self._drop_stale()
+        now = datetime.now(timezone.utc)
+        wake_at = min((t for t in (self.horizon_end, self.replan_at) if t), default=now)
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        timeout = max((wake_at - now).total_seconds(), 0)
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+scheduler = BirthdayScheduler()
+
+async def plan_birthdays(now_utc: datetime | None = None, guild_id: int | None = None):
+    # (re)schedule every birthday that starts somewhere before the horizon ends
+    now_utc = now_utc or datetime.now(timezone.utc)
+    if guild_id is None:
+        scheduler.horizon_end = now_utc + SCHEDULE_HORIZON
+    elif not scheduler_active():
+        return 0
+    rows = await store.birthdays_on(today_month_days(now_utc, scheduler.horizon_end), guild_id)
+    settings = {}
+    for row in rows:
+        gid = row["guild_id"]
+        if gid not in settings:
+            settings[gid] = store.get_guild_settings(gid)
+        tz_str = effective_tz(row, settings[gid])
+        scheduler.schedule(gid, row["user_id"], next_local_midnight(row["bday_month"], row["bday_day"], tz_str, now_utc))
+    return len(rows)
+
+def scheduler_active() -> bool:
+    # only the leader's heap is ever drained; anywhere else pushes would just pile up
+    return bot.cakey.is_leader and scheduler.horizon_end is not None
+
+def schedule_birthday(guild_id: int, user_id: int, month: int, day: int, tz_str: str | None):
+    # called after a birthday is saved so the scheduler never needs to poll for changes
+    if not scheduler_active():
+        return
+    scheduler.schedule(guild_id, user_id, next_local_midnight(month, day, tz_str))
+
+async def birthday_scheduler_loop():
+    await bot.wait_until_ready()
+    print("Birthday scheduler started.")
+    while not bot.is_closed():
+        now = datetime.now(timezone.utc)
+        if scheduler.horizon_end is None or now >= scheduler.horizon_end or (scheduler.replan_at and now >= scheduler.replan_at):
+            try:
+                planned = await plan_birthdays(now)
+            except Exception as e:
+                # this task isn't restarted if it dies; try the whole plan again shortly
+                print("birthday scheduler error:", e)
+                scheduler.replan_at = now + CHECK_RETRY
+            else:
+                scheduler.replan_at = now + SHARED_REPLAN_INTERVAL if store.shared else None
+                print(f"Birthday scheduler: planned {planned} birthdays until {scheduler.horizon_end:%Y-%m-%d %H:%M} UTC.")
+        due = scheduler.pop_due(now)
+        if due:
+            try:
+                # shielded: stopping the loops (lease lost, reload) never cuts a round short
+                retry = await asyncio.shield(birthday_checker(due))
+            except Exception as e:
+                print("birthday checker error:", e)
+                retry = due
+            # popped keys are otherwise gone until the next refill, by which time the day is usually over;
+            # once it is, the checker no longer matches them and the retries stop
+            for guild_id, user_id in retry:
+                scheduler.schedule(guild_id, user_id, now + CHECK_RETRY)
+            if retry:
+                print(f"Birthday checker: {len(retry)} birthdays retried in {CHECK_RETRY.seconds // 60} min.")
+        await scheduler.sleep_until_next()
+
+# ---------------- CHECK TODAY BIRTHDAYS ----------------
+async def birthday_checker(due_keys=None):
+    # returns [(guild_id, user_id)] that were due but couldn't be announced yet and are worth retrying
+    tick_start = time.perf_counter()
+    all_bdays = await fetch_today_candidates()
+    if due_keys is not None:
+        due_keys = set(due_keys)
+        all_bdays = [r for r in all_bdays if (r["guild_id"], r["user_id"]) in due_keys]
+    matched = 0
+    # dedup markers for every local date in play, loaded once; new ones are written in one batch
+    announced = await store.announced_keys([d.isoformat() for d in local_dates()])
+    new_markers = []
+    now = datetime.now(timezone.utc)
+
+    due = {}  # guild_id -> [(key, row)], so members are resolved per guild in one batch
+    for tz_str, rows in rows_by_timezone(all_bdays).items():
+        today_local = now.astimezone(resolve_tz(tz_str)).date()
+        for row in rows:
+            if not is_birthday_on(row["bday_month"], row["bday_day"], today_local):
+                continue
+            matched += 1
+            key = (row["guild_id"], row["user_id"], today_local.isoformat())
+            if key not in announced:
+                due.setdefault(row["guild_id"], []).append((key, row))
+
+    outbox_items = []
+    pending = {}  # dedup_key -> (guild, plan, members)
+    retry = []
+    for guild_id, items in due.items():
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            # not in our cache yet (startup, outage); a guild we've left is deactivated and stops matching
+            retry.extend((guild_id, row["user_id"]) for _, row in items)
+            continue
+        members = await member_cache.resolve(guild, [row["user_id"] for _, row in items])
+        gone = set(await deactivate_departed(guild, [row["user_id"] for _, row in items if row["user_id"] not in members]))
+        retry.extend((guild_id, row["user_id"]) for _, row in items if row["user_id"] not in members and row["user_id"] not in gone)
+        items = [(key, row, members[row["user_id"]]) for key, row in items if row["user_id"] in members]
+        if not items:
+            continue
+        settings_row = store.get_guild_settings(guild_id)
+        # digest mode: everyone due this tick shares one outbox item
+        groups = [items] if is_digest(settings_row) else [[item] for item in items]
+        for group in groups:
+            kind = "digest" if is_digest(settings_row) else "announce"
+            entries = [(member, row) for _, row, member in group]
+            plan = announce_plan(guild, kind, entries, settings_row)
+            item = outbox_item(kind, guild_id, [row["user_id"] for _, row, _ in group], group[0][0][2], plan)
+            outbox_items.append(item)
+            pending[item[0]] = (guild, plan, [member for member, _ in entries])
+            for key, _, _ in group:
+                announced.add(key)
+                new_markers.append(key)
+
+    if outbox_items:
+        # queued durably together with the markers; only rows new to the outbox are sent
+        for outbox_row in await store.enqueue_outbox(outbox_items, new_markers, bot.cakey.instance_id, bot.cakey.claim_ttl):
+            guild, plan, members = pending[outbox_row["dedup_key"]]
+            try:
+                await announce_birthday(guild, outbox_row, plan, members)
+            except Exception as e:
+                print("announce error:", e)
+    ROWS_SCANNED.inc(len(all_bdays), loop="checker")
+    ROWS_MATCHED.inc(matched, loop="checker")
+    TICK_SECONDS.observe(time.perf_counter() - tick_start, loop="checker")
+    print(f"Birthday checker: scanned {len(all_bdays)} rows, matched {matched}.")
+    return retry
+
+# ---------------- TASK: REMINDERS ----------------
+DEFAULT_REMINDER_DAYS = (7,)
+REMINDER_HOUR = 9  # reminders go out from 09:00 in the member's (or guild's) timezone
+REMINDER_TIMES = [dt_time(hour=h, minute=m, tzinfo=timezone.utc) for h in range(24) for m in (0, 15, 30, 45)]
+
+@functools.lru_cache(maxsize=256)
+def parse_reminder_days(value: str):
+    # "14,7,1" -> (14, 7, 1); raises ValueError on junk
+    days = sorted({int(v) for v in value.replace(" ", "").split(",") if v}, reverse=True)
+    if len(days) > 5 or any(not 1 <= d <= 60 for d in days):
+        raise ValueError("reminder days must be 1-60, at most 5 of them")
+    return tuple(days)
+
+def reminder_offsets(settings_row):
+    # NULL -> default, "" -> reminders off
+    value = settings_row.get("reminder_days") if settings_row else None
+    if value is None:
+        return DEFAULT_REMINDER_DAYS
+    try:
+        return parse_reminder_days(value)
+    except ValueError:
+        return DEFAULT_REMINDER_DAYS
+
+def doy_ranges(doys):
+    # day-of-year values -> merged inclusive (lo, hi) ranges
+    ranges = []
+    for doy in sorted(set(doys)):
+        if ranges and doy <= ranges[-1][1] + 1:
+            ranges[-1][1] = doy
+        else:
+            ranges.append([doy, doy])
+    return [tuple(r) for r in ranges]
+
+def reminder_target_ranges(offsets, dates):
+    # every birthday day-of-year that falls `offset` days after one of `dates`
+    doys = []
+    for d in dates:
+        for offset in offsets:
+            target = d + timedelta(days=offset)
+            doys.append(day_of_year(target.month, target.day))
+            if target.month == 2 and target.day == 28 and not calendar.isleap(target.year):
+                doys.append(day_of_year(2, 29))
+    return doy_ranges(doys)
+
+def reminder_embed(member: discord.Member, row, days: int):
+    if days == 7:
+        banter = random.choice(BANTER_7DAYS).replace("{user}", member.mention)
+    elif days == 1:
+        banter = random.choice(BANTER_TOMORROW).replace("{user}", member.mention)
+    else:
+        banter = random.choice(BANTER_SOON).replace("{user}", member.mention).replace("{days}", str(days))
+    embed = discord.Embed(
+        title="📅 Birthday Tomorrow" if days == 1 else f"📅 {days}-Day Birthday Alert",
+        description=banter,
+        colour=discord.Colour.gold()
+    )
+    embed.add_field(name="Birthday date", value=f"{row['bday_day']:02d}-{row['bday_month']:02d}", inline=True)
+    embed.set_footer(text="Set your birthday with /birthday set")
+    return embed
+
+@tasks.loop(time=REMINDER_TIMES)
+async def birthday_prechecker():
+    # runs every quarter hour on the UTC clock, so it lines up with local hours in every timezone;
+    # each reminder goes out on the first run after REMINDER_HOUR local, deduped by bday_reminded.
+    # Shielded so a stop can't drop the markers of reminders already queued.
+    await asyncio.shield(send_reminders())
+
+async def send_reminders():
+    tick_start = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    dates = local_dates(now)
+    offsets = set(DEFAULT_REMINDER_DAYS)
+    for settings_row in store.all_guild_settings():
+        offsets.update(reminder_offsets(settings_row))
+    # one indexed query for every birthday that is some guild's reminder offset away
+    ranges = reminder_target_ranges(offsets, dates)
+    all_bdays = await store.birthdays_in_doy_ranges(ranges) if ranges else []
+    matched = 0
+
+    reminded = await store.reminded_keys([d.isoformat() for d in dates])
+    new_markers = []
+    local_by_tz = {}  # tz string -> local datetime, computed once per distinct timezone this tick
+
+    guild_map = {}
+    for row in all_bdays:
+        guild_map.setdefault(row["guild_id"], []).append(row)
+
+    for guild_id, rows in guild_map.items():
+        settings_row = store.get_guild_settings(guild_id)
+        guild_offsets = reminder_offsets(settings_row)
+        channel_id = settings_row["announce_channel"] if settings_row else None
+        if not guild_offsets or not channel_id:
+            continue
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            continue
+        channel = guild.get_channel(channel_id)
+        if not channel:
+            continue
+
+        due = []
+        for row in rows:
+            tz_str = effective_tz(row, settings_row)
+            local_now = local_by_tz.get(tz_str)
+            if local_now is None:
+                local_now = local_by_tz[tz_str] = now.astimezone(resolve_tz(tz_str))
+            user_today = local_now.date()
+
+            delta = (next_birthday(row["bday_month"], row["bday_day"], user_today) - user_today).days
+
+            if delta in guild_offsets:
+                matched += 1
+                key = (guild_id, row["user_id"], user_today.isoformat())
+                if key not in reminded and local_now.hour >= REMINDER_HOUR:
+                    due.append((key, row, delta))
+
+        if due:
+            members = await member_cache.resolve(guild, [row["user_id"] for _, row, _ in due])
+            await deactivate_departed(guild, [row["user_id"] for _, row, _ in due])
+            for key, row, delta in due:
+                member = members.get(row["user_id"])
+                if not member:
+                    continue
+                embed = reminder_embed(member, row, delta)
+                pipeline.submit(channel.id, [Step(lambda channel=channel, embed=embed: channel.send(embed=embed))], label="reminder")
+                reminded.add(key)
+                new_markers.append(key)
+
+    if new_markers:
+        await store.mark_reminded_many(new_markers)
+    ROWS_SCANNED.inc(len(all_bdays), loop="prechecker")
+    ROWS_MATCHED.inc(matched, loop="prechecker")
+    TICK_SECONDS.observe(time.perf_counter() - tick_start, loop="prechecker")
+
+@birthday_prechecker.before_loop
+async def before_prechecker():
+    await bot.wait_until_ready()
+    print("Birthday reminder loop started.")
+
+
+# ---------------- TASK: BIRTHDAY ROLE EXPIRY ----------------
+@tasks.loop(minutes=5)
+async def role_expiry_sweeper():
+    # drains every expired grant in batches, including ones that expired while we were down
+    now = int(time.time())
+    removed = 0
+    while True:
+        rows = await store.expired_roles(now, ROLE_SWEEP_BATCH)
+        user_ids = {}
+        for r in rows:
+            user_ids.setdefault(r["guild_id"], []).append(r["user_id"])
+        members = {}
+        for guild_id, ids in user_ids.items():
+            guild = bot.get_guild(guild_id)
+            members[guild_id] = await member_cache.resolve(guild, ids) if guild else {}
+        done = []
+        for r in rows:
+            key = (r["guild_id"], r["user_id"], r["role_id"])
+            guild = bot.get_guild(r["guild_id"])
+            member = members[r["guild_id"]].get(r["user_id"])
+            role = guild.get_role(r["role_id"]) if guild else None
+            if member and role and role in member.roles:
+                try:
+                    await pipeline.call(lambda: member.remove_roles(role, reason="Birthday over"),
+                                        key=("roles", guild.id), op="remove_roles")
+                    removed += 1
+                except discord.Forbidden:
+                    pass
+                except discord.HTTPException as e:
+                    print("role expiry error:", e)
+                    continue  # keep the row, retry next sweep
+            done.append(key)
+        if done:
+            await store.delete_role_expiries(done)
+        if len(rows) < ROLE_SWEEP_BATCH or len(done) < len(rows):
+            break
+    if removed:
+        print(f"Role expiry sweeper: removed {removed} birthday roles.")
+
+@role_expiry_sweeper.before_loop
+async def before_role_sweeper():
+    await bot.wait_until_ready()
+    print("Birthday role sweeper started.")
+
+# ---------------- TASK: MARKER COMPACTION ----------------
+# dedup only ever looks at the 2-3 local dates in play; anything older is dead weight
+MARKER_RETENTION_DAYS = max(3, int(os.getenv("MARKER_RETENTION_DAYS", "30")))
+
+@tasks.loop(time=dt_time(hour=4, minute=10, tzinfo=timezone.utc))
+async def marker_compactor():
+    tick_start = time.perf_counter()
+    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=MARKER_RETENTION_DAYS)).isoformat()
+    r = await store.compact_markers(cutoff)
+    reclaimed = r["file_reclaimed"] + r["wal_reclaimed"]
+    DB_RECLAIMED_BYTES.inc(max(reclaimed, 0))
+    TICK_SECONDS.observe(time.perf_counter() - tick_start, loop="compactor")
+    print(
+        f"Marker compaction: deleted {r['deleted']} markers before {cutoff}, "
+        f"reclaimed {r['file_reclaimed'] // 1024} KiB of file and {r['wal_reclaimed'] // 1024} KiB of WAL"
+        + (" (checkpoint partial, readers busy)" if r["checkpoint_busy"] else "") + "."
+    )
+
+@marker_compactor.before_loop
+async def before_marker_compactor():
+    await bot.wait_until_ready()
+
+# ---------------- TASK: MEMBERSHIP RECONCILIATION ----------------
+# Rows of guilds we've left and members who've left are flagged inactive by the
+# events below, so the loops' partial indexes never return them. This pass catches
+# whatever happened while we were offline or the events were missed.
+async def deactivate_departed(guild: discord.Guild, user_ids):
+    # members a loop just failed to resolve because they've left
+    gone = member_cache.departed(guild, user_ids)
+    if gone:
+        await store.set_members_active(guild.id, gone, False)
+    return gone
+
+def gateway_complete():
+    # an empty or partial guild cache would look like we'd left everywhere
+    return bot.is_ready() and not any(s.is_closed() for s in getattr(bot, "shards", {}).values())
+
+async def reconcile_membership(members: bool = True):
+    if not gateway_complete():
+        print("Membership reconciliation skipped: gateway not fully connected.")
+        return
+    tick_start = time.perf_counter()
+    deactivated = reactivated = unchunked = 0
+    for summary in await store.birthday_guilds():
+        guild_id = summary["guild_id"]
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            if summary["active"]:
+                deactivated += await store.set_guild_active(guild_id, False)
+            continue
+        if guild.unavailable:
+            continue
+        if members and not guild.chunked:
+            # no member list to check against (LOW_MEMORY, or not chunked yet): every row would cost a
+            # gateway query, flooding the shard and the member LRU. Member events and the loops'
+            # own lookups keep these guilds' rows in line instead
+            unchunked += 1
+        if not members or not guild.chunked:
+            # back in a guild we'd left; members who left meanwhile drop out on the next full pass
+            if not summary["active"]:
+                reactivated += await store.set_guild_active(guild_id, True)
+            continue
+        rows = await store.guild_birthdays(guild_id)
+        present = await member_cache.resolve(guild, [r["user_id"] for r in rows])
+        gone = set(member_cache.departed(guild, [r["user_id"] for r in rows if r["user_id"] not in present]))
+        deactivated += await store.set_members_active(guild_id, [r["user_id"] for r in rows if r["active"] and r["user_id"] in gone], False)
+        reactivated += await store.set_members_active(guild_id, [r["user_id"] for r in rows if not r["active"] and r["user_id"] in present], True)
+    if reactivated and scheduler.horizon_end:
+        await plan_birthdays()
+    TICK_SECONDS.observe(time.perf_counter() - tick_start, loop="reconciler")
+    print(
+        f"Membership reconciliation{'' if members else ' (guilds only)'}: deactivated {deactivated} rows, reactivated {reactivated}"
+        + (f", {unchunked} unchunked guilds checked at guild level only." if unchunked else ".")
+    )
+
+@tasks.loop(time=dt_time(hour=3, minute=40, tzinfo=timezone.utc))
+async def membership_reconciler():
+    await reconcile_membership()
+
+@membership_reconciler.before_loop
+async def before_membership_reconciler():
+    await bot.wait_until_ready()
+
+
+# ---------------- PAGINATED VIEWS ----------------
+PAGE_SIZE = 15
+WISH_PAGE_SIZE = 8
+PAGE_CACHE_TTL = 60
+
+# guild_id -> {(kind, params, cursor): (expires_at, lines, next_cursor)}; dropped when the guild's data changes
+page_cache = {}
+page_cache_swept = 0.0
+
+def invalidate_pages(guild_id: int):
+    page_cache.pop(guild_id, None)
+
+def cache_page(guild_id: int, key, lines, next_cursor):
+    # expired pages are swept out here, at most once per TTL, so guilds nobody pages through again don't pile up
+    global page_cache_swept
+    now = time.monotonic()
+    if now - page_cache_swept >= PAGE_CACHE_TTL:
+        page_cache_swept = now
+        for gid in list(page_cache):
+            cache = page_cache[gid]
+            for k in [k for k, hit in cache.items() if hit[0] <= now]:
+                del cache[k]
+            if not cache:
+                del page_cache[gid]
+    page_cache.setdefault(guild_id, {})[key] = (now + PAGE_CACHE_TTL, lines, next_cursor)
+
+def upcoming_segments(today: date, days: int):
+    # the "next N days" window as inclusive (month, day) ranges, split where it wraps past 31 Dec
+    start = (today.month, today.day)
+    if days >= 365:
+        if start == (1, 1):
+            return [((1, 1), (12, 31))]
+        return [(start, (12, 31)), ((1, 1), (start[0], start[1] - 1))]
+    end_date = today + timedelta(days=days)
+    end = (end_date.month, end_date.day)
+    if end == (2, 28) and not calendar.isleap(end_date.year):
+        end = (2, 29)  # leap-day birthdays land on 28 Feb this year
+    if start <= end:
+        return [(start, end)]
+    return [(start, (12, 31)), ((1, 1), end)]
+
+class BirthdayPages:
+    """Keyset pages over (month, day, user_id) for one guild; a cursor is (segment, month, day, user_id)."""
+
+    def __init__(self, guild: discord.Guild, kind: str, params, segments, render, title: str, colour, page_size: int = PAGE_SIZE, wishes_only: bool = False, total: int | None = None):
+        self.guild = guild
+        self.kind = kind
+        self.params = params
+        self.segments = segments
+        self.render = render
+        self.title = title
+        self.colour = colour
+        self.page_size = page_size
+        self.wishes_only = wishes_only
+        self.total = total
+        self.start = (0, *segments[0][0], -1)
+
+    async def fetch(self, cursor):
+        key = (self.kind, self.params, cursor)
+        hit = page_cache.get(self.guild.id, {}).get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1], hit[2]
+
+        seg, m, d, u = cursor
+        rows = []
+        while seg < len(self.segments):
+            want = self.page_size + 1 - len(rows)
+            got = await store.birthday_page(self.guild.id, (m, d, u), self.segments[seg][1], want, self.wishes_only)
+            rows.extend((seg, r) for r in got)
+            if len(got) == want:
+                break
+            seg += 1
+            if seg < len(self.segments):
+                m, d, u = (*self.segments[seg][0], -1)
+
+        next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last_seg, last = rows[-1]
+            next_cursor = (last_seg, last["bday_month"], last["bday_day"], last["user_id"])
+        await member_cache.resolve(self.guild, [r["user_id"] for _, r in rows])  # warms member_cache.get for the renderers
+        lines = [self.render(self.guild, r) for _, r in rows]
+        cache_page(self.guild.id, key, lines, next_cursor)
+        return lines, next_cursor
+
+    def embed(self, lines, page_no: int):
+        embed = discord.Embed(
+            title=self.title,
+            description=("\n\n" if self.wishes_only else "\n").join(lines),
+            colour=self.colour
+        )
+        footer = f"Page {page_no + 1}"
+        if self.total is not None:
+            footer += f" · {self.total} birthdays"
+        embed.set_footer(text=footer)
+        return embed
+
+class BirthdayPageView(discord.ui.View):
+    def __init__(self, pages: BirthdayPages, owner_id: int):
+        super().__init__(timeout=300)
+        self.pages = pages
+        self.owner_id = owner_id
+        self.cursors = [pages.start]  # start cursor of every page seen so far
+        self.page_no = 0
+        self.next_cursor = None
+
+    async def first_page(self):
+        lines, self.next_cursor = await self.pages.fetch(self.cursors[0])
+        self._sync_buttons()
+        return lines
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.page_no == 0
+        self.next_page.disabled = self.next_cursor is None
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.owner_id
+
+    async def _show(self, interaction: discord.Interaction):
+        lines, self.next_cursor = await self.pages.fetch(self.cursors[self.page_no])
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.pages.embed(lines, self.page_no), view=self)
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page_no = max(self.page_no - 1, 0)
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is None:
+            return await interaction.response.defer()
+        self.page_no += 1
+        del self.cursors[self.page_no:]
+        self.cursors.append(self.next_cursor)
+        await self._show(interaction)
+
+async def send_pages(interaction: discord.Interaction, pages: BirthdayPages, empty_msg: str):
+    # answer first: resolving the page's members can mean gateway member queries in LOW_MEMORY
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    view = BirthdayPageView(pages, interaction.user.id)
+    lines = await view.first_page()
+    if not lines:
+        return await interaction.followup.send(empty_msg, ephemeral=True)
+    if view.next_cursor is None:
+        await interaction.followup.send(embed=pages.embed(lines, 0), ephemeral=True)  # single page, no buttons
+    else:
+        await interaction.followup.send(embed=pages.embed(lines, 0), view=view, ephemeral=True)
+
+def render_upcoming(today: date):
+    def render(guild: discord.Guild, r):
+        delta = (next_birthday(r["bday_month"], r["bday_day"], today) - today).days
+        member = member_cache.get(guild, r["user_id"])
+        name = member.mention if member else f"<@{r['user_id']}>"
+        return f"**{delta}d** → {name} ({r['bday_day']:02d}-{r['bday_month']:02d})"
+    return render
+
+def render_month(guild: discord.Guild, r):
+    member = member_cache.get(guild, r["user_id"])
+    name = member.display_name if member else f"User {r['user_id']}"
+    return f"**{r['bday_day']:02d}** — {name}"
+
+def render_wish(guild: discord.Guild, r):
+    member = member_cache.get(guild, r["user_id"])
+    name = member.display_name if member else f"User {r['user_id']}"
+    return f"**{r['bday_day']:02d}-{r['bday_month']:02d}** — {name}:\n> {r['birthday_wish'][:180]}"
+
+# ---------------- COG / SLASH COMMANDS ----------------
+class BirthdayModal(discord.ui.Modal, title="Set your birthday"):
+    day = discord.ui.TextInput(label="Day (1-31)", placeholder="31", max_length=2)
+    month = discord.ui.TextInput(label="Month (1-12)", placeholder="10", max_length=2)
+    wish = discord.ui.TextInput(
+        label="Birthday wish (optional)",
+        style=discord.TextStyle.paragraph,
+        required=False,
+        max_length=200,
+    )
+
+    def __init__(self, interaction: discord.Interaction):
+        super().__init__()
+        self.interaction = interaction
+
+    async def on_submit(self, interaction: discord.Interaction):
+        guild = interaction.guild
+        user = interaction.user
+
+        # validate
+        try:
+            day_i = int(str(self.day.value).strip())
+            month_i = int(str(self.month.value).strip())
+            _ = datetime(2000, month_i, day_i)  # just to validate
+        except Exception:
+            return await interaction.response.send_message(
+                "❌ Day/Month invalid. Use e.g. day=31, month=10",
+                ephemeral=True,
+            )
+
+        wish_text = str(self.wish.value).strip() if self.wish.value else None
+
+        # stored without a timezone, so later changes to the guild default still apply
+        auto_tz = guild_tz(store.get_guild_settings(guild.id))
+
+        # insert new, unless the user already has a birthday
+        added = await store.add_birthday(guild.id, user.id, day_i, month_i, None, wish_text)
+        if not added:
+            return await interaction.response.send_message(
+                "⚠️ You already set your birthday. Ask an admin to change it with `/birthday set_for @you`.",
+                ephemeral=True,
+            )
+        schedule_birthday(guild.id, user.id, month_i, day_i, auto_tz)
+        invalidate_pages(guild.id)
+
+        await interaction.response.send_message(
+            f"✅ Saved **{day_i:02d}-{month_i:02d}**. Timezone: `{auto_tz}` (change it with `/birthday timezone`)"
+            + (f"\n📝 Wish: {wish_text}" if wish_text else ""),
+            ephemeral=True,
+        )
+
+        # funny confirmation
+        today = date.today()
+        next_bday = next_birthday(month_i, day_i, today)
+        days_left = (next_bday - today).days
+
+        funny_lines = [
+            f"Alright {user.mention}, I’ve scribbled **{day_i:02d}-{month_i:02d}** in frosting on my calendar 🍰 ({days_left} days to go).",
+            f"Got it {user.mention}! I’ll start pre-heating the chaos oven 🔥 — your big day’s in **{days_left} days**.",
+            f"Duly noted {user.mention}. Expect confetti, cake, and mild regret in **{days_left} days** 🎈.",
+            f"Okay {user.mention}, birthday locked in. I’ll pretend to forget until **{days_left} days** from now 😏.",
+            f"Mark my frosting-covered words, {user.mention} — **{days_left} days** till your glorious descent into more candles 🕯️.",
+            f"Calendar updated, {user.mention}. I’ll annoy everyone about you in **{days_left} days** 💅.",
+            f"Saved. {user.mention} will be officially unbearable in **{days_left} days** 😌.",
+            f"Done ✅ {user.mention}, I’ll ping the whole house in **{days_left} days** like a proud aunty.",
+            f"{user.mention} has chosen violence on **{day_i:02d}-{month_i:02d}**. Countdown: **{days_left} days** ⚔️🎂",
+            f"Your day is locked, {user.mention}. Don’t change it or I’m telling Jas. **{days_left} days** 👀",
+            f"Birthday entered. I’ll act surprised in **{days_left} days**, promise 🤭.",
+            f"Alright starboy/starbabe {user.mention}, **{days_left} days** till we shout about you in caps 💜.",
+            f"I’ve put **{day_i:02d}-{month_i:02d}** in pen, not pencil. That’s commitment, {user.mention}. **{days_left} days** 📝",
+            f"Noted, {user.mention}. I’ll be extremely dramatic about it in **{days_left} days** 🎭.",
+            f"Schedule updated 📅 → {user.mention} gets attention in **{days_left} days**. Everyone else: cope.",
+            f"OOOH okay {user.mention}, birthday princess/prince energy arriving in **{days_left} days** 👑.",
+            f"Thanks, {user.mention}. I’ll drag everyone back to the channel in **{days_left} days** 🫡.",
+            f"Copy that. {user.mention} → **{day_i:02d}-{month_i:02d}** → cake → chaos → **{days_left} days**.",
+            f"Logged. If anyone says ‘I forgot’, I’ll show them this. **{days_left} days**, {user.mention} 🧾.",
+            f"Okayyy {user.mention}, attention deposit received. Collection in **{days_left} days** 💅.",
+            f"Your birthday has been uploaded to the Cloud of Vibes ☁️ {user.mention} — **{days_left} days**.",
+            f"Reminder armed. In **{days_left} days** I will roast you lovingly, {user.mention} 🔔.",
+            f"Booked, blessed, and ready. {user.mention} is due celebration in **{days_left} days** 🙌.",
+            f"{user.mention}, I will loudly expose your birthday in **{days_left} days** like a proper Discord auntie 🫶.",
+            f"Okay but don’t act surprised when I scream about it in **{days_left} days**, {user.mention} 😌.",
+            f"Set. If the server forgets, I won’t. **{days_left} days** till {user.mention} becomes the main character ✨.",
+            f"Birthday secured 🔐 {user.mention} → **{day_i:02d}-{month_i:02d}** → I’m telling everyone in **{days_left} days**.",
+            f"Nice try hiding, {user.mention}. I caught it. **{days_left} days** till your cake day 🎂.",
+            f"Calendar says: ‘Disturb {user.mention} with love in **{days_left} days**.’ I obey calendars 📅.",
+            f"Alright then, chaos child {user.mention} — **{days_left} days** and we’re singing off-key 🎤.",
+        ]
+
+        funny_reply = random.choice(funny_lines)
+
+        await interaction.followup.send(funny_reply)
+
+
+
+class BirthdayCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    group = app_commands.Group(name="birthday", description="Birthday commands")
+
+    # /birthday set -> modal
+    @group.command(name="set", description="Set your birthday")
+    async def set_birthday(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(BirthdayModal(interaction))
+
+    # /birthday view
+    @group.command(name="view", description="View someone's birthday")
+    async def view_birthday(self, interaction: discord.Interaction, user: discord.Member | None = None):
+        user = user or interaction.user
+        row = await store.get_birthday(interaction.guild_id, user.id)
+        if not row:
+            return await interaction.response.send_message("No birthday set for that user.", ephemeral=True)
+
+        bday_str = format_birthday(row)
+        tz = effective_tz(row, store.get_guild_settings(interaction.guild_id))
+        embed = discord.Embed(
+            title=f"🎂 {user.display_name}'s birthday",
+            description=f"**{bday_str}**",
+            colour=discord.Colour.blurple()
+        )
+        embed.add_field(name="Timezone", value=tz)
+        if row["birthday_wish"]:
+            embed.add_field(name="Wish", value=row["birthday_wish"], inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    # /birthday upcoming
+    @group.command(name="upcoming", description="Show upcoming birthdays")
+    @app_commands.describe(days="How many days ahead to look (default 30)")
+    async def upcoming(self, interaction: discord.Interaction, days: int = 30):
+        if days < 0:
+            return await interaction.response.send_message("No upcoming birthdays in that range.", ephemeral=True)
+
+        today = date.today()
+        segments = upcoming_segments(today, days)
+        pages = BirthdayPages(
+            interaction.guild, "upcoming", (today, days), segments, render_upcoming(today),
+            title=f"🎉 Upcoming birthdays (next {days} days)",
+            colour=discord.Colour.green(),
+            total=await store.count_birthdays(interaction.guild_id, segments),
+        )
+        await send_pages(interaction, pages, "No upcoming birthdays in that range.")
+
+    # /birthday list
+    @group.command(name="list", description="List all birthdays for a month")
+    @app_commands.describe(month="Month number 1-12")
+    async def list_month(self, interaction: discord.Interaction, month: int):
+        if not (1 <= month <= 12):
+            return await interaction.response.send_message("Month must be 1-12.", ephemeral=True)
+        segments = [((month, 1), (month, 31))]
+        pages = BirthdayPages(
+            interaction.guild, "list", month, segments, render_month,
+            title=f"📅 Birthdays in month {month}",
+            colour=discord.Colour.orange(),
+            total=await store.count_birthdays(interaction.guild_id, segments),
+        )
+        await send_pages(interaction, pages, "No birthdays for that month.")
+
+    # ADMIN: /birthday channel
+    @group.command(name="channel", description="Set the birthday announce channel (admin)")
+    @app_commands.describe(channel="Channel to post birthday messages")
+    async def set_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, announce_channel=channel.id)
+        await interaction.response.send_message(f"✅ Announce channel set to {channel.mention}", ephemeral=True)
+
+    # ADMIN: /birthday role
+    @group.command(name="role", description="Set the birthday role (admin)")
+    @app_commands.describe(role="Role to give on birthday for 24h")
+    async def set_role(self, interaction: discord.Interaction, role: discord.Role):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, birthday_role=role.id)
+        await interaction.response.send_message(f"✅ Birthday role set to {role.mention}", ephemeral=True)
+
+    # ADMIN: /birthday message
+    @group.command(name="message", description="Set the birthday announce message (admin)")
+    @app_commands.describe(text="Use {mention}, {user}, {date}")
+    async def set_message(self, interaction: discord.Interaction, text: str):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, announce_text=text)
+        await interaction.response.send_message("✅ Birthday message updated.", ephemeral=True)
+
+    # ADMIN: /birthday mode
+    @group.command(name="mode", description="One card per birthday, or one daily digest card (admin)")
+    @app_commands.describe(mode="each = card + song per member, digest = one combined card", sing="Digest only: sing once for everyone")
+    async def set_mode(self, interaction: discord.Interaction, mode: Literal["each", "digest"], sing: bool = True):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, announce_mode=mode, digest_sing=int(sing))
+        if mode == "digest":
+            note = "with one song for everyone" if sing else "without the song"
+            return await interaction.response.send_message(f"✅ Birthdays will be announced as one digest card, {note}.", ephemeral=True)
+        await interaction.response.send_message("✅ Each birthday gets its own card and song.", ephemeral=True)
+
+    # ADMIN: /birthday reminders
+    @group.command(name="reminders", description="Set how many days ahead reminders go out (admin)")
+    @app_commands.describe(days="Comma-separated days before the birthday, e.g. 14,7,1 — or 'off'")
+    async def set_reminders(self, interaction: discord.Interaction, days: str):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        if days.strip().lower() in ("off", "none", "0"):
+            await store.set_guild_setting(interaction.guild_id, reminder_days="")
+            return await interaction.response.send_message("✅ Birthday reminders turned off.", ephemeral=True)
+        try:
+            offsets = parse_reminder_days(days)
+        except ValueError:
+            offsets = ()
+        if not offsets:
+            return await interaction.response.send_message("❌ Use up to 5 numbers from 1 to 60, e.g. `14,7,1`.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, reminder_days=",".join(map(str, offsets)))
+        await interaction.response.send_message(f"✅ Reminders {', '.join(f'{d}d' for d in offsets)} before birthdays.", ephemeral=True)
+
+    # /birthday timezone
+    @group.command(name="timezone", description="Set the timezone your birthday is celebrated in")
+    @app_commands.describe(timezone="e.g. America/New_York — start typing a city")
+    @app_commands.autocomplete(timezone=timezone_autocomplete)
+    async def set_timezone(self, interaction: discord.Interaction, timezone: str):
+        tz = canonical_tz(timezone)
+        if tz is None:
+            return await interaction.response.send_message("❌ Invalid timezone. Pick one from the list.", ephemeral=True)
+        row = await store.set_birthday_timezone(interaction.guild_id, interaction.user.id, tz)
+        if row is None:
+            return await interaction.response.send_message("Set your birthday first with `/birthday set`.", ephemeral=True)
+        schedule_birthday(interaction.guild_id, interaction.user.id, row["bday_month"], row["bday_day"], tz)
+        await interaction.response.send_message(f"✅ Your birthday will be celebrated at midnight `{tz}`.", ephemeral=True)
+
+    # ADMIN: /birthday default_tz
+    @group.command(name="default_tz", description="Set default timezone for this guild (admin)")
+    @app_commands.autocomplete(timezone=timezone_autocomplete)
+    async def set_default_tz(self, interaction: discord.Interaction, timezone: str):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server.", ephemeral=True)
+        timezone = canonical_tz(timezone)
+        if timezone is None:
+            return await interaction.response.send_message("❌ Invalid timezone.", ephemeral=True)
+        await store.set_guild_setting(interaction.guild_id, default_timezone=timezone)
+        await plan_birthdays(guild_id=interaction.guild_id)
+        await interaction.response.send_message(f"✅ Default timezone set to `{timezone}`", ephemeral=True)
+
+    @group.command(name="set_for", description="(admin) Set or change someone's birthday")
+    @app_commands.describe(
+        user="Member to set the birthday for",
+        day="Day 1-31",
+        month="Month 1-12",
+        wish="Optional birthday wish from them"
+    )
+    async def set_for(self, interaction: discord.Interaction, user: discord.Member, day: int, month: int, wish: str | None = None):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server to do this.", ephemeral=True)
+
+        # validate date
+        try:
+            _ = datetime(2000, month, day)
+        except Exception:
+            return await interaction.response.send_message("❌ Invalid day/month.", ephemeral=True)
+
+        # NULL keeps a timezone the member picked with /birthday timezone (the upsert coalesces)
+        await store.upsert_birthday(interaction.guild_id, user.id, day, month, None, wish)
+        row = await store.get_birthday(interaction.guild_id, user.id)
+        schedule_birthday(interaction.guild_id, user.id, month, day, effective_tz(row, store.get_guild_settings(interaction.guild_id)))
+        invalidate_pages(interaction.guild_id)
+
+        await interaction.response.send_message(
+            f"✅ Set birthday for {user.mention} → **{day:02d}-{month:02d}**",
+            ephemeral=True
+        )
+
+
+    # ADMIN: /birthday import
+    @group.command(name="import", description="(admin) Import birthdays from a CSV/JSON file")
+    @app_commands.describe(file="CSV or JSON/JSONL with user_id, day, month and optional timezone, wish")
+    async def import_birthdays(self, interaction: discord.Interaction, file: discord.Attachment):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server to do this.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        data = await file.read()
+        try:
+            rows, errors = await asyncio.to_thread(parse_import, data, file.filename, interaction.guild_id)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return await interaction.followup.send(f"❌ Couldn't read that file: {e}", ephemeral=True)
+
+        if rows:
+            try:
+                await store.upsert_birthdays_many(rows)
+            except Exception as e:
+                # one transaction, so nothing was saved
+                print("import error:", e)
+                return await interaction.followup.send("❌ Import failed, no birthdays were saved. Please try again.", ephemeral=True)
+            # rows without a timezone keep the member's own, so reschedule from what's stored
+            await plan_birthdays(guild_id=interaction.guild_id)
+            invalidate_pages(interaction.guild_id)
+
+        msg = f"✅ Imported **{len(rows)}** birthdays."
+        if errors:
+            msg += f"\n⚠️ Skipped {len(errors)} rows:\n" + "\n".join(errors[:MAX_IMPORT_ERRORS_SHOWN])
+            if len(errors) > MAX_IMPORT_ERRORS_SHOWN:
+                msg += f"\n…and {len(errors) - MAX_IMPORT_ERRORS_SHOWN} more."
+        await interaction.followup.send(msg[:2000], ephemeral=True)
+
+    # ADMIN: /birthday export
+    @group.command(name="export", description="(admin) Export this server's birthdays to a file")
+    @app_commands.rename(fmt="format")
+    async def export_birthdays(self, interaction: discord.Interaction, fmt: Literal["csv", "jsonl"] = "csv"):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server to do this.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        try:
+            with os.fdopen(fd, "w", newline="", encoding="utf-8") as fh:
+                count = await store.iter_guild_birthdays(interaction.guild_id, export_writer(fh, fmt))
+            if not count:
+                return await interaction.followup.send("No birthdays saved yet.", ephemeral=True)
+            await interaction.followup.send(
+                f"📦 Exported **{count}** birthdays.",
+                file=discord.File(path, filename=f"birthdays-{interaction.guild_id}.{fmt}"),
+                ephemeral=True,
+            )
+        finally:
+            os.remove(path)
+
+    # ADMIN: /birthday wishes
+    @group.command(name="wishes", description="(admin) View birthday wishes")
+    async def view_wishes(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("You need Manage Server to view wishes.", ephemeral=True)
+        pages = BirthdayPages(
+            interaction.guild, "wishes", None, [((1, 1), (12, 31))], render_wish,
+            title="🎁 Birthday wishes",
+            colour=discord.Colour.purple(),
+            page_size=WISH_PAGE_SIZE,
+            wishes_only=True,
+        )
+        await send_pages(interaction, pages, "No wishes submitted yet 💤")
+
+    # OWNER: /birthday stats
+    @group.command(name="stats", description="(owner) Loop, database and Discord API stats")
+    async def stats(self, interaction: discord.Interaction):
+        # process-wide numbers (every guild's traffic), so server admins aren't enough
+        if not await bot.is_owner(interaction.user):
+            return await interaction.response.send_message("Only the bot owner can do this.", ephemeral=True)
+        await interaction.response.send_message(embed=stats_embed(), ephemeral=True)
+
+    # EVENTS: registered with the cog, so a reload swaps them too
+    @commands.Cog.listener()
+    async def on_leader_change(self, leader: bool):
+        # dispatched by birthday_bot.lease_keeper
+        if leader:
+            start_loops()
+        else:
+            stop_loops()
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        # settings and birthdays survive in the DB if we were removed earlier and re-added
+        await store.reload_guild_settings(guild.id)
+        if await store.set_guild_active(guild.id, True):
+            await plan_birthdays(guild_id=guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        store.forget_guild_settings(guild.id)
+        invalidate_pages(guild.id)
+        member_cache.forget(guild.id)
+        await store.set_guild_active(guild.id, False)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        # a returning member's birthday counts again; read first so ordinary joins cost no write
+        row = await store.get_birthday(member.guild.id, member.id)
+        if row is None or row["active"]:
+            return
+        member_cache.forget(member.guild.id, member.id)  # drop the cached "left"
+        await store.set_members_active(member.guild.id, [member.id], True)
+        schedule_birthday(member.guild.id, member.id, row["bday_month"], row["bday_day"], effective_tz(row, store.get_guild_settings(member.guild.id)))
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        # raw event: fires even when the member wasn't cached (LOW_MEMORY)
+        member_cache.forget(payload.guild_id, payload.user.id)
+        row = await store.get_birthday(payload.guild_id, payload.user.id)
+        if row is None or not row["active"]:
+            return
+        await store.set_members_active(payload.guild_id, [payload.user.id], False)
+        scheduler.unschedule(payload.guild_id, payload.user.id)
+
+
+
+def stats_embed():
+    embed = discord.Embed(title="📊 Cakey stats", colour=discord.Colour.teal())
+    for loop in ("checker", "prechecker"):
+        count, mean, last = TICK_SECONDS.summary(loop=loop)
+        embed.add_field(
+            name=f"Birthday {loop}",
+            value=(
+                f"{count} ticks · last {last * 1000:.0f} ms · avg {mean * 1000:.0f} ms\n"
+                f"rows scanned {ROWS_SCANNED.get(loop=loop):,.0f} · matched {ROWS_MATCHED.get(loop=loop):,.0f}"
+            ),
+            inline=False,
+        )
+    db_count, db_sum = DB_SECONDS.totals()
+    embed.add_field(
+        name="Database",
+        value=(
+            f"{db_count} calls · avg {(db_sum / db_count * 1000) if db_count else 0:.1f} ms · "
+            f"{DB_RECLAIMED_BYTES.total() / 1024:,.0f} KiB reclaimed by compaction"
+        ),
+        inline=False,
+    )
+    api_lines = []
+    for op in ("send", "add_roles", "remove_roles"):
+        count, mean, _ = DISCORD_SECONDS.summary(op=op)
+        if count:
+            api_lines.append(f"`{op}` {count} · avg {mean * 1000:.0f} ms · {DISCORD_ERRORS.get(op=op):.0f} errors")
+    ann_count, ann_mean, _ = ANNOUNCE_CALLS.summary()
+    api_lines.append(f"{ann_count} announcements · {ann_mean:.1f} API calls each · {pipeline.pending()} jobs queued")
+    embed.add_field(name="Discord API", value="\n".join(api_lines), inline=False)
+    return embed
+
+# ---------------- LOOPS ----------------
+# Only the leader lease holder runs these (see birthday_bot.py). Each round is
+# idempotent (dedup markers, outbox keys), so a round that finishes after the
+# loops were stopped is harmless.
+@tasks.loop(seconds=OUTBOX_REPLAY_INTERVAL)
+async def outbox_replayer():
+    await replay_outbox()
+
+@outbox_replayer.before_loop
+async def before_outbox_replayer():
+    await bot.wait_until_ready()
+
+LOOPS = (birthday_prechecker, role_expiry_sweeper, marker_compactor, membership_reconciler, outbox_replayer)
+for loop in LOOPS:
+    # tasks.loop stops for good on anything outside its reconnect list; a DB blip retries the round
+    loop.add_exception_type(*DB_ERRORS)
+
+@tasks.loop(seconds=SHARED_REPLAN_INTERVAL.total_seconds())
+async def settings_refresher():
+    # every replica, shared database only: /birthday channel, mode, role... may have been
+    # handled by another replica, and the settings cache only sees local writes
+    try:
+        await store.refresh_guild_settings()
+    except Exception as e:
+        print("settings refresh error:", e)
+scheduler_task = None
+
+def start_loops():
+    global scheduler_task
+    if scheduler_task is None or scheduler_task.done():
+        scheduler_task = bot.loop.create_task(birthday_scheduler_loop())
+    for loop in LOOPS:
+        if not loop.is_running():
+            loop.start()
+    # guilds joined or left while nobody was holding the lease; the member pass is daily
+    bot.loop.create_task(reconcile_membership(members=False))
+
+def stop_loops():
+    global scheduler_task
+    running = [t for t in [scheduler_task] + [loop.get_task() for loop in LOOPS] if t and not t.done()]
+    if scheduler_task is not None:
+        scheduler_task.cancel()
+        scheduler_task = None
+    scheduler.clear()
+    for loop in LOOPS:
+        loop.cancel()
+    return running
+
+# ---------------- EXTENSION ----------------
+async def setup(client: commands.Bot):
+    global bot, store, pipeline, member_cache, tz_index
+    bot = client
+    store, pipeline, member_cache = client.cakey.store, client.cakey.pipeline, client.cakey.member_cache
+    tz_index = await asyncio.to_thread(TimezoneIndex.build)
+    await client.add_cog(BirthdayCog(client))  # adds /birthday to the tree and the listeners above
+    if store.shared:
+        settings_refresher.start()
+    if client.cakey.is_leader:
+        # what we'd queued before the reload is still claimed by us, so the replayer skips it
+        start_loops()
+
+async def teardown(client: commands.Bot):
+    # the cog is removed by discord.py; wait for the cancelled loops to actually end so that,
+    # if the new version fails to load, the old setup() can start these same loops again
+    running = stop_loops()
+    if settings_refresher.is_running():
+        settings_refresher.cancel()
+        running.append(settings_refresher.get_task())
+    await asyncio.gather(*running, return_exceptions=True)
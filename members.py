@@ -0,0 +1,114 @@
+# members.py
+# Cakey – on-demand member lookups for low-memory mode
+# ---------------------------------------------------------------
+# With LOW_MEMORY=1 the bot neither chunks guilds nor caches members, so
+# guild.get_member only knows a handful of people. The loops and list views
+# only ever need the few users they are about to mention, so those are
+# resolved in batches (query_members over the gateway, fetch_member as a
+# fallback) and kept in a small LRU. When a guild *is* fully chunked its cache
+# is authoritative and nothing is fetched.
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+import discord
+
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "5000"))
+MEMBER_CACHE_TTL = 600     # seconds; cached members don't get gateway updates (roles, nick)
+QUERY_BATCH = 100          # Discord's max user_ids per member request
+
+
+class MemberCache:
+    def __init__(self, maxsize: int = MEMBER_CACHE_SIZE, ttl: float = MEMBER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lru = OrderedDict()  # (guild_id, user_id) -> (expires, member or None if not in guild)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _lookup(self, guild_id: int, user_id: int):
+        # returns (hit, member)
+        key = (guild_id, user_id)
+        entry = self._lru.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            del self._lru[key]
+            return False, None
+        self._lru.move_to_end(key)
+        return True, entry[1]
+
+    def _put(self, guild_id: int, user_id: int, member):
+        self._lru[(guild_id, user_id)] = (time.monotonic() + self.ttl, member)
+        self._lru.move_to_end((guild_id, user_id))
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def get(self, guild: discord.Guild, user_id: int):
+        # sync drop-in for guild.get_member: library cache first, then ours
+        member = guild.get_member(user_id)
+        if member is None:
+            member = self._lookup(guild.id, user_id)[1]
+        return member
+
+    def forget(self, guild_id: int, user_id: int = None):
+        if user_id is not None:
+            self._lru.pop((guild_id, user_id), None)
+            return
+        for key in [k for k in self._lru if k[0] == guild_id]:
+            del self._lru[key]
+
+    def departed(self, guild: discord.Guild, user_ids):
+        # ids known to have left: missing from a chunked guild, or cached as gone by resolve();
+        # lookups that merely failed are not included
+        gone = []
+        for user_id in user_ids:
+            if guild.get_member(user_id) is not None:
+                continue
+            hit, member = self._lookup(guild.id, user_id)
+            if guild.chunked or (hit and member is None):
+                gone.append(user_id)
+        return gone
+
+    async def resolve(self, guild: discord.Guild, user_ids):
+        # user_id -> Member for everyone still in the guild; one request per 100 unknown ids
+        found = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id)
+            if member is None:
+                hit, member = self._lookup(guild.id, user_id)
+                if not hit and not guild.chunked:
+                    missing.append(user_id)
+                    continue
+            if member is not None:
+                found[user_id] = member
+
+        for i in range(0, len(missing), QUERY_BATCH):
+            batch = missing[i:i + QUERY_BATCH]
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+                result = dict.fromkeys(batch)  # anyone not returned has left the guild
+                result.update((m.id, m) for m in members)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                print("query_members failed, falling back to fetch_member:", e)
+                result = await self._fetch_each(guild, batch)
+            for user_id, member in result.items():
+                self._put(guild.id, user_id, member)  # None is cached too, so leavers aren't re-queried
+                if member is not None:
+                    found[user_id] = member
+        return found
+
+    async def _fetch_each(self, guild: discord.Guild, user_ids):
+        # ids that failed for other reasons are left out and retried next time
+        result = {}
+        for user_id in user_ids:
+            try:
+                result[user_id] = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                result[user_id] = None
+            except discord.HTTPException as e:
+                print("fetch_member error:", e)
+        return result
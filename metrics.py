@@ -0,0 +1,167 @@
+# metrics.py
+# Cakey – in-process counters / latency histograms
+# ---------------------------------------------------------------
+# Everything is kept in plain dicts keyed by label tuples; no client library.
+# Read it via /birthday stats or the Prometheus text endpoint
+# (set METRICS_PORT, binds to METRICS_HOST, default 127.0.0.1).
+import os
+import time
+import functools
+from contextlib import contextmanager
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = endpoint disabled
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels.get(n, "") for n in self.labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label key -> [bucket counts..., sum, count, last]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        s = self.series.get(key)
+        if s is None:
+            s = self.series[key] = [0] * len(self.buckets) + [0.0, 0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                s[i] += 1
+        s[-3] += value
+        s[-2] += 1
+        s[-1] = value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self, **labels):
+        # (count, mean, last) for one label set
+        s = self.series.get(tuple(labels.get(n, "") for n in self.labels))
+        if not s or not s[-2]:
+            return 0, 0.0, 0.0
+        return s[-2], s[-3] / s[-2], s[-1]
+
+    def totals(self):
+        # (count, sum) across every label set
+        return sum(s[-2] for s in self.series.values()), sum(s[-3] for s in self.series.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, s in sorted(self.series.items()):
+            names = self.labels + ("le",)
+            for bound, count in zip(self.buckets, s):
+                lines.append(f"{self.name}_bucket{_label_str(names, key + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {s[-2]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {s[-3]}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {s[-2]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help: str, labels=()):
+        m = Counter(name, help, labels)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        m = Histogram(name, help, labels, buckets)
+        self.metrics.append(m)
+        return m
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TICK_SECONDS = REGISTRY.histogram("cakey_tick_seconds", "Duration of one loop tick", ("loop",))
+ROWS_SCANNED = REGISTRY.counter("cakey_rows_scanned_total", "Birthday rows read by a loop tick", ("loop",))
+ROWS_MATCHED = REGISTRY.counter("cakey_rows_matched_total", "Birthday rows due in a loop tick", ("loop",))
+DB_SECONDS = REGISTRY.histogram("cakey_db_seconds", "Latency of one storage call, including pool wait", ("op",))
+DB_ERRORS = REGISTRY.counter("cakey_db_errors_total", "Storage calls that raised", ("op",))
+DISCORD_SECONDS = REGISTRY.histogram("cakey_discord_seconds", "Latency of one Discord API call (after rate-budget wait)", ("op",))
+DISCORD_ERRORS = REGISTRY.counter("cakey_discord_errors_total", "Discord API calls that raised", ("op",))
+DB_RECLAIMED_BYTES = REGISTRY.counter("cakey_db_reclaimed_bytes_total", "Database + WAL bytes freed by marker compaction")
+ANNOUNCE_CALLS = REGISTRY.histogram(
+    "cakey_announcement_api_calls", "Discord API calls queued per announcement", buckets=(1, 2, 4, 6, 8, 12, 20)
+)
+
+
+def timed_db(fn):
+    # decorator for Storage coroutines: latency + error count per method name
+    op = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(op=op)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, op=op)
+    return wrapper
+
+
+async def start_http_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    # Prometheus text endpoint at http://host:port/metrics (aiohttp ships with discord.py)
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,173 @@
+# sendqueue.py
+# Cakey – outbound Discord send pipeline
+# ---------------------------------------------------------------
+# Announcements are queued per channel and drained by one short-lived worker
+# per busy channel. Workers run concurrently, but every API call goes through:
+#   - a per-key route budget: messages per channel (Discord allows ~5 / 5s), role changes per guild (~10 / 10s)
+#   - a global budget (Discord allows 50 requests/s per bot; we allow 45 in any 1s window)
+#   - a global concurrency limit
+# Waiting between steps (e.g. the sing delay) or for a full channel never holds a concurrency slot.
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+
+from metrics import DISCORD_SECONDS, DISCORD_ERRORS
+
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+GLOBAL_RATE = (45, 1.0)
+CHANNEL_RATE = (5, 5.0)
+ROLE_RATE = (10, 10.0)
+# Discord limits messages per channel and role changes per guild in separate buckets; an op that goes
+# over its route limit is held back inside discord.py *after* taking a global slot, then bursts
+ROUTE_RATES = {"send": CHANNEL_RATE, "add_roles": ROLE_RATE, "remove_roles": ROLE_RATE}
+
+
+class RateBudget:
+    """Sliding window: at most `limit` calls in any `per` seconds, however the calls are spaced.
+
+    A call holds its slot while in flight and is stamped when it finishes, so however late its
+    request actually reaches Discord, it is counted in a window that contains it."""
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self._calls = deque()  # finish times of the calls in the last `per` seconds
+        self._in_flight = 0
+        self._finished = asyncio.Event()
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def _wait_locked(self):
+        # a token bucket of the same size would let a full burst plus a full refill through
+        # in the first `per` seconds, i.e. twice the limit
+        while True:
+            now = time.monotonic()
+            while self._calls and self._calls[0] <= now - self.per:
+                self._calls.popleft()
+            if len(self._calls) + self._in_flight < self.limit:
+                return
+            if self._calls:
+                await asyncio.sleep(self._calls[0] + self.per - now)
+            else:
+                self._finished.clear()
+                await self._finished.wait()
+
+    async def wait(self):
+        # until a slot is free, without taking it
+        async with self._lock:
+            await self._wait_locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._lock:
+            await self._wait_locked()
+            self._in_flight += 1
+            self._updated = time.monotonic()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._updated = time.monotonic()
+            self._calls.append(self._updated)
+            self._finished.set()
+
+
+class Step:
+    """One API call in a job; `delay` seconds are waited before it runs, `op` labels its metrics
+    (and picks which ROUTE_RATES budget of the queue key it counts against)."""
+
+    __slots__ = ("fn", "delay", "op")
+
+    def __init__(self, fn, delay: float = 0.0, op: str = "send"):
+        self.fn = fn
+        self.delay = delay
+        self.op = op
+
+
+class SendPipeline:
+    def __init__(self, concurrency: int = SEND_CONCURRENCY, global_rate=GLOBAL_RATE, route_rates=None):
+        self._sem = asyncio.Semaphore(concurrency)
+        self._global = RateBudget(*global_rate)
+        self._route_rates = ROUTE_RATES if route_rates is None else route_rates
+        self._budgets = {}   # (queue key, rate) -> RateBudget
+        self._queues = {}    # queue key -> deque of (steps, label, progress)
+        self._workers = {}   # queue key -> worker task, only while the queue has work
+
+    def pending(self):
+        return sum(len(q) for q in self._queues.values())
+
+    async def call(self, fn, key=None, op: str = "send"):
+        # run one API call under the budgets + concurrency limit; exceptions propagate
+        rate = self._route_rates.get(op) if key is not None else None
+        budget = self._budget(key, rate) if rate is not None else None
+        if budget is not None:
+            # a full channel (or guild, for roles) waits here, not holding a concurrency slot
+            await budget.wait()
+        # both windows are charged only now, right before the request goes out, so queueing for the
+        # semaphore or the global budget can't bunch one key's real requests past its limit
+        async with self._sem, self._global.slot(), budget.slot() if budget is not None else nullcontext():
+            start = time.perf_counter()
+            try:
+                return await fn()
+            except Exception:
+                DISCORD_ERRORS.inc(op=op)
+                raise
+            finally:
+                DISCORD_SECONDS.observe(time.perf_counter() - start, op=op)
+
+    def submit(self, key, steps, label: str = "send", progress=None):
+        # queue an ordered job for one channel (or any hashable key); returns immediately.
+        # progress(done, error) is awaited after every step (error=None) and once if a step fails
+        if not steps:
+            return
+        self._queues.setdefault(key, deque()).append((steps, label, progress))
+        if key not in self._workers:
+            self._prune_budgets()
+            self._workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    def _prune_budgets(self):
+        # an idle key's bucket is full again after `per` seconds, so it can be recreated later
+        now = time.monotonic()
+        for bkey in [k for k, b in self._budgets.items() if b._updated < now - b.per and k[0] not in self._workers]:
+            del self._budgets[bkey]
+
+    def _budget(self, key, rate):
+        budget = self._budgets.get((key, rate))
+        if budget is None:
+            budget = self._budgets[(key, rate)] = RateBudget(*rate)
+        return budget
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                steps, label, progress = queue.popleft()
+                for done, step in enumerate(steps, 1):
+                    if step.delay:
+                        await asyncio.sleep(step.delay)
+                    try:
+                        await self.call(step.fn, key, step.op)
+                    except Exception as e:
+                        # rest of this job is pointless (e.g. no card -> no song)
+                        print(f"{label} error:", e)
+                        await self._report(progress, label, done - 1, e)
+                        break
+                    await self._report(progress, label, done, None)
+        finally:
+            self._workers.pop(key, None)
+            self._queues.pop(key, None)
+
+    async def _report(self, progress, label, done, error):
+        if progress is None:
+            return
+        try:
+            await progress(done, error)
+        except Exception as e:
+            print(f"{label} progress error:", e)
+
+    async def join(self):
+        # wait for everything queued so far (used on shutdown)
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
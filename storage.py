@@ -0,0 +1,802 @@
+# storage.py
+# Cakey – async storage layer
+# ---------------------------------------------------------------
+# Every query the bot runs goes through a BaseStorage. Two backends:
+#   - SQLiteStorage (default, DB_PATH): one local file
+#   - PostgresStorage (pg_storage.py, DATABASE_URL=postgresql://...): shared
+#     by several replicas, which take turns running the loops via a lease
+# create_storage() picks one from the environment.
+#
+# SQLite connections are long-lived:
+#   - reads run on a small thread pool, one sqlite3 connection per thread
+#   - writes are serialized through a single writer thread/connection
+# sqlite3 caches prepared statements per connection by SQL text, so the
+# queries below are module constants and get reused on every call.
+import os
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import timed_db
+
+try:
+    import asyncpg
+except ImportError:  # only needed for DATABASE_URL
+    asyncpg = None
+
+READ_THREADS = int(os.getenv("DB_READ_THREADS", "4"))
+MIGRATION_BUSY_TIMEOUT = 3600  # seconds init_db waits for another process's migration
+
+SCHEMA_V1 = """
+    CREATE TABLE IF NOT EXISTS birthdays (
+        guild_id      INTEGER NOT NULL,
+        user_id       INTEGER NOT NULL,
+        bday_day      INTEGER NOT NULL,
+        bday_month    INTEGER NOT NULL,
+        bday_year     INTEGER,
+        timezone      TEXT,
+        show_year     INTEGER DEFAULT 0,
+        birthday_wish TEXT,
+        UNIQUE(guild_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS guild_settings (
+        guild_id          INTEGER PRIMARY KEY,
+        announce_channel  INTEGER,
+        birthday_role     INTEGER,
+        announce_text     TEXT,
+        default_timezone  TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS bday_announced (
+        guild_id     INTEGER NOT NULL,
+        user_id      INTEGER NOT NULL,
+        announce_date TEXT NOT NULL,
+        PRIMARY KEY (guild_id, user_id, announce_date)
+    );
+
+    CREATE TABLE IF NOT EXISTS bday_reminded (
+        guild_id     INTEGER NOT NULL,
+        user_id      INTEGER NOT NULL,
+        remind_date  TEXT NOT NULL,
+        PRIMARY KEY (guild_id, user_id, remind_date)
+    );
+
+    -- checker only ever needs rows whose (month, day) is "today" somewhere
+    CREATE INDEX IF NOT EXISTS idx_birthdays_month_day ON birthdays (bday_month, bday_day);
+
+    -- keyset pagination for list / upcoming / wishes
+    CREATE INDEX IF NOT EXISTS idx_birthdays_guild_keyset ON birthdays (guild_id, bday_month, bday_day, user_id);
+
+    -- each tick preloads one day's dedup markers in a single query
+    CREATE INDEX IF NOT EXISTS idx_bday_announced_date ON bday_announced (announce_date);
+    CREATE INDEX IF NOT EXISTS idx_bday_reminded_date ON bday_reminded (remind_date);
+
+    -- birthday roles to take back; survives restarts, drained by the sweeper
+    CREATE TABLE IF NOT EXISTS role_expiry (
+        guild_id    INTEGER NOT NULL,
+        user_id     INTEGER NOT NULL,
+        role_id     INTEGER NOT NULL,
+        expires_at  INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id, role_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_role_expiry_expires ON role_expiry (expires_at);
+"""
+
+
+def _add_legacy_columns(con):
+    # DBs from before birthday_wish / favourite_cake existed
+    cols = [r[1] for r in con.execute("PRAGMA table_info(birthdays)")]
+    if "birthday_wish" not in cols:
+        con.execute("ALTER TABLE birthdays ADD COLUMN birthday_wish TEXT")
+    if "favourite_cake" not in cols:
+        con.execute("ALTER TABLE birthdays ADD COLUMN favourite_cake TEXT")
+
+
+def _enable_incremental_vacuum(con):
+    # auto_vacuum only changes on a full VACUUM; one-off cost, afterwards the compactor
+    # hands free pages back with PRAGMA incremental_vacuum
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        return "VACUUM"  # can't run inside the migration's transaction
+
+
+def _split_sql(script: str):
+    # a migration script as single statements; ";" inside strings, comments or triggers doesn't split
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \t\n;"):
+                yield statement
+            statement = ""
+
+
+# Ordered; each runs once, in its own transaction, and is recorded in schema_version.
+# Append new steps here, never edit an applied one. A step is SQL or fn(con); fn may
+# return a statement to run after the commit.
+MIGRATIONS = [
+    (1, "base schema", SCHEMA_V1),
+    (2, "legacy birthday columns", _add_legacy_columns),
+    (3, "app_meta key/value table", """
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key    TEXT PRIMARY KEY,
+            value  TEXT
+        );
+    """),
+    (4, "reminder offsets + birthday day-of-year", """
+        ALTER TABLE guild_settings ADD COLUMN reminder_days TEXT;
+        -- day of year in a leap year (1-366), matches day_of_year() in the bot
+        ALTER TABLE birthdays ADD COLUMN bday_doy INTEGER GENERATED ALWAYS AS (
+            CASE bday_month WHEN 1 THEN 0 WHEN 2 THEN 31 WHEN 3 THEN 60 WHEN 4 THEN 91 WHEN 5 THEN 121
+                WHEN 6 THEN 152 WHEN 7 THEN 182 WHEN 8 THEN 213 WHEN 9 THEN 244 WHEN 10 THEN 274
+                WHEN 11 THEN 305 ELSE 335 END + bday_day
+        ) VIRTUAL;
+        CREATE INDEX IF NOT EXISTS idx_birthdays_doy ON birthdays (bday_doy);
+    """),
+    (5, "digest announce mode", """
+        ALTER TABLE guild_settings ADD COLUMN announce_mode TEXT;
+        ALTER TABLE guild_settings ADD COLUMN digest_sing INTEGER;
+    """),
+    # date-first clustered keys: the per-tick lookup and the retention delete are both
+    # prefix range scans on the primary key, so the separate date indexes go away
+    (6, "dedup markers WITHOUT ROWID", """
+        CREATE TABLE bday_announced_new (
+            announce_date TEXT NOT NULL,
+            guild_id      INTEGER NOT NULL,
+            user_id       INTEGER NOT NULL,
+            PRIMARY KEY (announce_date, guild_id, user_id)
+        ) WITHOUT ROWID;
+        INSERT INTO bday_announced_new (announce_date, guild_id, user_id)
+            SELECT announce_date, guild_id, user_id FROM bday_announced;
+        DROP TABLE bday_announced;
+        ALTER TABLE bday_announced_new RENAME TO bday_announced;
+
+        CREATE TABLE bday_reminded_new (
+            remind_date   TEXT NOT NULL,
+            guild_id      INTEGER NOT NULL,
+            user_id       INTEGER NOT NULL,
+            PRIMARY KEY (remind_date, guild_id, user_id)
+        ) WITHOUT ROWID;
+        INSERT INTO bday_reminded_new (remind_date, guild_id, user_id)
+            SELECT remind_date, guild_id, user_id FROM bday_reminded;
+        DROP TABLE bday_reminded;
+        ALTER TABLE bday_reminded_new RENAME TO bday_reminded;
+    """),
+    (7, "incremental auto_vacuum", _enable_incremental_vacuum),
+    (8, "announcement outbox", """
+        -- one row per announcement (or digest); written in the same transaction as the
+        -- dedup markers, then drained step by step so a restart resumes instead of repeating
+        CREATE TABLE IF NOT EXISTS outbox (
+            id          INTEGER PRIMARY KEY,
+            dedup_key   TEXT NOT NULL UNIQUE,
+            guild_id    INTEGER NOT NULL,
+            kind        TEXT NOT NULL,               -- 'announce' | 'digest'
+            users       TEXT NOT NULL,               -- JSON list of user ids
+            day         TEXT NOT NULL,               -- local date being celebrated
+            step        INTEGER NOT NULL DEFAULT 0,  -- steps already sent
+            status      TEXT NOT NULL DEFAULT 'pending',
+            created_at  INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (created_at) WHERE status='pending';
+    """),
+    (9, "leader leases", """
+        -- which replica runs the announcement loops; held while expires_at keeps moving
+        CREATE TABLE IF NOT EXISTS leases (
+            name        TEXT PRIMARY KEY,
+            holder      TEXT NOT NULL,
+            expires_at  INTEGER NOT NULL
+        );
+    """),
+    # rows for guilds the bot has left or members who have left stay in the table
+    # (they come back if the guild/member does) but drop out of the loops' indexes
+    (10, "active flag + partial loop indexes", """
+        ALTER TABLE birthdays ADD COLUMN active INTEGER NOT NULL DEFAULT 1;
+        DROP INDEX IF EXISTS idx_birthdays_month_day;
+        DROP INDEX IF EXISTS idx_birthdays_doy;
+        CREATE INDEX IF NOT EXISTS idx_birthdays_active_month_day ON birthdays (bday_month, bday_day) WHERE active=1;
+        CREATE INDEX IF NOT EXISTS idx_birthdays_active_doy ON birthdays (bday_doy) WHERE active=1;
+    """),
+    # which process is sending an outbox row; replay leaves it alone while the claim is renewed
+    (11, "outbox claims", """
+        ALTER TABLE outbox ADD COLUMN holder TEXT;
+        ALTER TABLE outbox ADD COLUMN claimed_until INTEGER NOT NULL DEFAULT 0;
+    """),
+    # what a row sends (channel, role, rendered messages), so `step` keeps pointing at the same message
+    (12, "outbox plans", """
+        ALTER TABLE outbox ADD COLUMN plan TEXT;
+    """),
+]
+
+# ---------------- SQL ----------------
+SQL_GUILD_SETTINGS = "SELECT * FROM guild_settings WHERE guild_id=?"
+SQL_ALL_GUILD_SETTINGS = "SELECT * FROM guild_settings WHERE 1=1{shard}"
+GUILD_SETTING_COLUMNS = ("announce_channel", "birthday_role", "announce_text", "default_timezone", "reminder_days", "announce_mode", "digest_sing")
+
+SQL_BIRTHDAY = "SELECT * FROM birthdays WHERE guild_id=? AND user_id=?"
+SQL_SET_BIRTHDAY_TIMEZONE = "UPDATE birthdays SET timezone=? WHERE guild_id=? AND user_id=? RETURNING *"
+SQL_SET_GUILD_ACTIVE = "UPDATE birthdays SET active=? WHERE guild_id=? AND active<>?"
+SQL_SET_MEMBER_ACTIVE = "UPDATE birthdays SET active=? WHERE guild_id=? AND user_id=? AND active<>?"
+SQL_BIRTHDAY_GUILDS = "SELECT guild_id, SUM(active) AS active, COUNT(*) AS total FROM birthdays WHERE 1=1{shard} GROUP BY guild_id"
+SQL_GUILD_BIRTHDAYS = "SELECT * FROM birthdays WHERE guild_id=?"
+SQL_EXPORT_BIRTHDAYS = "SELECT * FROM birthdays WHERE guild_id=? ORDER BY bday_month, bday_day, user_id"
+SQL_BIRTHDAY_PAGE = """
+    SELECT * FROM birthdays
+    WHERE guild_id=? AND (bday_month, bday_day, user_id) > (?, ?, ?) AND (bday_month, bday_day) <= (?, ?)
+    ORDER BY bday_month, bday_day, user_id
+    LIMIT ?
+"""
+SQL_WISH_PAGE = """
+    SELECT * FROM birthdays
+    WHERE guild_id=? AND (bday_month, bday_day, user_id) > (?, ?, ?) AND (bday_month, bday_day) <= (?, ?)
+      AND birthday_wish IS NOT NULL AND birthday_wish <> ''
+    ORDER BY bday_month, bday_day, user_id
+    LIMIT ?
+"""
+SQL_ADD_BIRTHDAY = """
+    INSERT INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, show_year, birthday_wish)
+    VALUES (?, ?, ?, ?, ?, 0, ?)
+    ON CONFLICT(guild_id, user_id) DO NOTHING
+"""
+SQL_UPSERT_BIRTHDAY = """
+    INSERT INTO birthdays (guild_id, user_id, bday_day, bday_month, timezone, show_year, birthday_wish)
+    VALUES (?, ?, ?, ?, ?, 0, ?)
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        bday_day=excluded.bday_day,
+        bday_month=excluded.bday_month,
+        timezone=COALESCE(excluded.timezone, birthdays.timezone),
+        birthday_wish=COALESCE(excluded.birthday_wish, birthdays.birthday_wish),
+        active=1
+"""
+
+SQL_MARK_ANNOUNCED = "INSERT OR IGNORE INTO bday_announced (guild_id, user_id, announce_date) VALUES (?,?,?)"
+SQL_MARK_REMINDED = "INSERT OR IGNORE INTO bday_reminded (guild_id, user_id, remind_date) VALUES (?,?,?)"
+SQL_ENQUEUE_OUTBOX = """
+    INSERT INTO outbox (dedup_key, guild_id, kind, users, day, created_at, plan, holder, claimed_until)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, strftime('%s','now') + ?)
+    ON CONFLICT(dedup_key) DO NOTHING
+    RETURNING *
+"""
+SQL_OUTBOX_PROGRESS = "UPDATE outbox SET step=?, status=? WHERE id=?"
+SQL_PENDING_OUTBOX = """
+    SELECT * FROM outbox
+    WHERE status='pending' AND created_at>=? AND created_at<? AND claimed_until < strftime('%s','now'){shard}
+    ORDER BY created_at LIMIT ?
+"""
+SQL_CLAIM_OUTBOX = """
+    UPDATE outbox SET holder=?, claimed_until=strftime('%s','now') + ?
+    WHERE id=? AND status='pending' AND claimed_until < strftime('%s','now')
+    RETURNING *
+"""
+SQL_RENEW_OUTBOX_CLAIMS = "UPDATE outbox SET claimed_until=strftime('%s','now') + ? WHERE id=? AND holder=? AND status='pending'"
+SQL_EXPIRE_OUTBOX = "UPDATE outbox SET status='expired' WHERE status='pending' AND created_at<?"
+SQL_PRUNE_OUTBOX = "DELETE FROM outbox WHERE status<>'pending' AND day<?"
+MARKER_TABLES = (("bday_announced", "announce_date"), ("bday_reminded", "remind_date"))
+
+SQL_ADD_ROLE_EXPIRY = """
+    INSERT INTO role_expiry (guild_id, user_id, role_id, expires_at) VALUES (?,?,?,?)
+    ON CONFLICT(guild_id, user_id, role_id) DO UPDATE SET expires_at=excluded.expires_at
+"""
+SQL_GET_META = "SELECT value FROM app_meta WHERE key=?"
+SQL_SET_META = "INSERT INTO app_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+SQL_EXPIRED_ROLES = "SELECT * FROM role_expiry WHERE expires_at<=?{shard} ORDER BY expires_at LIMIT ?"
+SQL_ACQUIRE_LEASE = """
+    INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, strftime('%s','now') + ?)
+    ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+        WHERE leases.holder=excluded.holder OR leases.expires_at < strftime('%s','now')
+    RETURNING holder
+"""
+SQL_RELEASE_LEASE = "DELETE FROM leases WHERE name=? AND holder=?"
+SQL_DELETE_ROLE_EXPIRY = "DELETE FROM role_expiry WHERE guild_id=? AND user_id=? AND role_id=?"
+
+def _placeholders(count: int):
+    return ", ".join("?" for _ in range(count))
+
+def _month_day_where(count: int):
+    # OR of equality pairs so SQLite can use idx_birthdays_active_month_day for each term;
+    # active=1 has to sit inside every term for the partial index to qualify
+    return " OR ".join("(bday_month=? AND bday_day=? AND active=1)" for _ in range(count))
+
+def _segments_where(count: int):
+    # inclusive (month, day) ranges, the same bounds the keyset pages walk
+    return " OR ".join("((bday_month, bday_day) >= (?, ?) AND (bday_month, bday_day) <= (?, ?))" for _ in range(count))
+
+
+def shard_clause(shard_count: int | None, shard_ids=None):
+    # Discord's shard formula; empty when this process owns every shard
+    if not shard_count or shard_ids is None or set(shard_ids) >= set(range(shard_count)):
+        return ""
+    return f" AND ((guild_id >> 22) % {int(shard_count)}) IN ({', '.join(str(int(i)) for i in sorted(shard_ids))})"
+
+
+# what a dropped connection or a busy database raises; the loops retry on these instead of stopping
+DB_ERRORS = (sqlite3.OperationalError,) + ((asyncpg.InterfaceError, asyncpg.PostgresError) if asyncpg else ())
+
+
+def create_storage(path: str, shard_count: int | None = None, shard_ids=None):
+    # DATABASE_URL=postgresql://... selects Postgres (needs asyncpg), otherwise SQLite at `path`
+    url = os.getenv("DATABASE_URL", "")
+    if url.startswith(("postgres://", "postgresql://")):
+        from pg_storage import PostgresStorage
+        return PostgresStorage(url, shard_count=shard_count, shard_ids=shard_ids)
+    return SQLiteStorage(path, shard_count=shard_count, shard_ids=shard_ids)
+
+
+class BaseStorage(ABC):
+    """What the bot needs from a database. Backends implement every abstract coroutine below
+    (a backend missing one fails when it is constructed); the guild settings cache and shard filter are shared."""
+
+    shared = False  # True when other replicas may write to the same database
+
+    def __init__(self, shard_count: int | None = None, shard_ids=None):
+        # loop queries only see guilds on this process's shards (constant per process,
+        # so it is baked into the SQL text and statements still get cached)
+        self.shard = shard_clause(shard_count, shard_ids)
+        self._settings = {}  # guild_id -> settings dict, write-through
+
+    # lifecycle: open() migrates and loads the settings cache; aclose() releases connections
+    @abstractmethod
+    async def open(self): ...
+    @abstractmethod
+    async def aclose(self): ...
+
+    # ---------------- GUILD SETTINGS ----------------
+    # guild_settings is tiny and read on every hot path, so it is held in memory
+    # for the whole process and only written through set_guild_setting. With a shared
+    # database the bot also calls refresh_guild_settings periodically to see other replicas' writes.
+    def forget_guild_settings(self, guild_id: int):
+        # bot left the guild; rows stay in the DB in case it comes back
+        self._settings.pop(guild_id, None)
+
+    def get_guild_settings(self, guild_id: int):
+        return self._settings.get(guild_id)
+
+    def all_guild_settings(self):
+        return self._settings.values()
+
+    def _check_setting_columns(self, kwargs):
+        for k in kwargs:
+            if k not in GUILD_SETTING_COLUMNS:
+                raise ValueError(f"unknown guild setting: {k}")
+
+    @abstractmethod
+    async def reload_guild_settings(self, guild_id: int): ...
+    @abstractmethod
+    async def refresh_guild_settings(self): ...  # whole cache, for shared DBs
+    @abstractmethod
+    async def set_guild_setting(self, guild_id: int, **kwargs): ...
+    @abstractmethod
+    async def get_meta(self, key: str): ...
+    @abstractmethod
+    async def set_meta(self, key: str, value: str): ...
+
+    # birthdays
+    @abstractmethod
+    async def get_birthday(self, guild_id: int, user_id: int): ...
+    @abstractmethod
+    async def guild_birthdays(self, guild_id: int): ...
+    @abstractmethod
+    async def count_birthdays(self, guild_id: int, segments): ...
+    @abstractmethod
+    async def birthday_page(self, guild_id: int, after, until, limit: int, wishes_only: bool = False): ...
+    @abstractmethod
+    async def birthdays_on(self, pairs, guild_id: int | None = None): ...
+    @abstractmethod
+    async def birthdays_in_doy_ranges(self, ranges): ...
+    @abstractmethod
+    async def birthdays_for_users(self, guild_id: int, user_ids): ...
+    @abstractmethod
+    async def set_birthday_timezone(self, guild_id: int, user_id: int, tz: str): ...
+    @abstractmethod
+    async def set_guild_active(self, guild_id: int, active: bool): ...
+    @abstractmethod
+    async def set_members_active(self, guild_id: int, user_ids, active: bool): ...
+    @abstractmethod
+    async def birthday_guilds(self): ...
+    @abstractmethod
+    async def add_birthday(self, guild_id: int, user_id: int, day: int, month: int, tz: str, wish: str | None): ...
+    @abstractmethod
+    async def upsert_birthday(self, guild_id: int, user_id: int, day: int, month: int, tz: str, wish: str | None): ...
+    @abstractmethod
+    async def upsert_birthdays_many(self, rows): ...
+    @abstractmethod
+    async def iter_guild_birthdays(self, guild_id: int, fn): ...
+
+    # dedup markers, outbox, compaction
+    @abstractmethod
+    async def announced_keys(self, dates): ...
+    @abstractmethod
+    async def mark_announced_many(self, keys): ...
+    @abstractmethod
+    async def reminded_keys(self, dates): ...
+    @abstractmethod
+    async def mark_reminded_many(self, keys): ...
+    @abstractmethod
+    async def enqueue_outbox(self, items, markers, holder: str, ttl: int): ...
+    @abstractmethod
+    async def outbox_progress(self, outbox_id: int, step: int, status: str = "pending"): ...
+    @abstractmethod
+    async def pending_outbox(self, since: int, until: int, limit: int): ...
+    @abstractmethod
+    async def claim_outbox(self, ids, holder: str, ttl: int): ...
+    @abstractmethod
+    async def renew_outbox_claims(self, ids, holder: str, ttl: int): ...
+    @abstractmethod
+    async def expire_outbox(self, before: int): ...
+    @abstractmethod
+    async def compact_markers(self, cutoff: str, batch: int = 5000): ...
+
+    # role expiry
+    @abstractmethod
+    async def add_role_expiry(self, guild_id: int, user_id: int, role_id: int, expires_at: int): ...
+    @abstractmethod
+    async def expired_roles(self, now: int, limit: int): ...
+    @abstractmethod
+    async def delete_role_expiries(self, keys): ...
+
+    # leader lease: True while `holder` owns `name`; renew well inside ttl seconds
+    @abstractmethod
+    async def acquire_lease(self, name: str, holder: str, ttl: int): ...
+    @abstractmethod
+    async def release_lease(self, name: str, holder: str): ...
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str, read_threads: int = READ_THREADS, shard_count: int | None = None, shard_ids=None):
+        super().__init__(shard_count, shard_ids)
+        self.path = path
+        # make sure dir exists if path is like /data/birthdays.db (once, not per call)
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="cakey-db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cakey-db-write")
+
+    # ---------------- CONNECTIONS ----------------
+    def _connect(self, timeout: float = 30):
+        con = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False, cached_statements=256)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def _conn(self):
+        # one connection per pool thread, opened on first use and kept for the process lifetime
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._connect()
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+    async def _read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, lambda: fn(self._conn(), *args))
+
+    async def _write(self, fn, *args):
+        def run():
+            con = self._conn()
+            with con:  # one transaction per write call
+                return fn(con, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, run)
+
+    async def open(self):
+        # sync under the hood; nothing else touches the DB this early
+        self.init_db()
+        self.load_guild_settings()
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+
+    # ---------------- SCHEMA ----------------
+    def init_db(self):
+        # runs once at startup (open(), or directly from scripts); a no-op past the version check once up to date.
+        # Cluster children start together on one file: each step takes the write lock (BEGIN IMMEDIATE)
+        # and re-reads the version under it, so a step another process just applied is skipped, the
+        # SQLite counterpart of pg_storage's advisory lock. A process waiting on another one's migration
+        # (the VACUUM that switches on auto_vacuum can take minutes on a big file) waits as long as it takes.
+        con = self._connect(timeout=MIGRATION_BUSY_TIMEOUT)
+        con.isolation_level = None  # transactions below are explicit
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at INTEGER NOT NULL)")
+        current = con.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            after = None
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                current = con.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+                if version <= current:
+                    con.execute("ROLLBACK")
+                    continue
+                if callable(step):
+                    after = step(con)
+                else:
+                    # executescript() would commit the BEGIN IMMEDIATE first
+                    for statement in _split_sql(step):
+                        con.execute(statement)
+                con.execute("INSERT INTO schema_version (version, applied_at) VALUES (?, strftime('%s','now'))", (version,))
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            if after:
+                con.execute(after)
+            print(f"DB migration {version} applied: {name}")
+        con.close()
+
+    @timed_db
+    async def get_meta(self, key: str):
+        row = await self._read(lambda con: con.execute(SQL_GET_META, (key,)).fetchone())
+        return row["value"] if row else None
+
+    @timed_db
+    async def set_meta(self, key: str, value: str):
+        await self._write(lambda con: con.execute(SQL_SET_META, (key, value)))
+
+    # ---------------- GUILD SETTINGS ----------------
+    def load_guild_settings(self):
+        # runs once at startup
+        con = self._connect()
+        rows = con.execute(SQL_ALL_GUILD_SETTINGS.format(shard=self.shard)).fetchall()
+        con.close()
+        self._settings = {r["guild_id"]: dict(r) for r in rows}
+        return len(self._settings)
+
+    @timed_db
+    async def refresh_guild_settings(self):
+        sql = SQL_ALL_GUILD_SETTINGS.format(shard=self.shard)
+        rows = await self._read(lambda con: con.execute(sql).fetchall())
+        self._settings = {r["guild_id"]: dict(r) for r in rows}
+        return len(self._settings)
+
+    @timed_db
+    async def reload_guild_settings(self, guild_id: int):
+        row = await self._read(lambda con: con.execute(SQL_GUILD_SETTINGS, (guild_id,)).fetchone())
+        if row:
+            self._settings[guild_id] = dict(row)
+        else:
+            self._settings.pop(guild_id, None)
+
+    @timed_db
+    async def set_guild_setting(self, guild_id: int, **kwargs):
+        self._check_setting_columns(kwargs)
+        cols = list(kwargs)
+        sql = (
+            f"INSERT INTO guild_settings (guild_id, {', '.join(cols)}) VALUES (?{', ?' * len(cols)}) "
+            f"ON CONFLICT(guild_id) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in cols)} "
+            "RETURNING *"
+        )
+        params = (guild_id, *kwargs.values())
+        row = await self._write(lambda con: con.execute(sql, params).fetchone())
+        self._settings[guild_id] = dict(row)
+
+    # ---------------- BIRTHDAYS ----------------
+    @timed_db
+    async def get_birthday(self, guild_id: int, user_id: int):
+        return await self._read(lambda con: con.execute(SQL_BIRTHDAY, (guild_id, user_id)).fetchone())
+
+    @timed_db
+    async def guild_birthdays(self, guild_id: int):
+        return await self._read(lambda con: con.execute(SQL_GUILD_BIRTHDAYS, (guild_id,)).fetchall())
+
+    @timed_db
+    async def count_birthdays(self, guild_id: int, segments):
+        # how many rows the keyset pages over `segments` will show; an index-only count on idx_birthdays_guild_keyset
+        sql = f"SELECT COUNT(*) FROM birthdays WHERE guild_id=? AND ({_segments_where(len(segments))})"
+        params = [guild_id, *(v for lo, hi in segments for v in (*lo, *hi))]
+        return await self._read(lambda con: con.execute(sql, params).fetchone()[0])
+
+    @timed_db
+    async def birthday_page(self, guild_id: int, after, until, limit: int, wishes_only: bool = False):
+        # keyset page: rows with (month, day, user_id) > after and (month, day) <= until
+        sql = SQL_WISH_PAGE if wishes_only else SQL_BIRTHDAY_PAGE
+        params = (guild_id, *after, *until, limit)
+        return await self._read(lambda con: con.execute(sql, params).fetchall())
+
+    @timed_db
+    async def birthdays_on(self, pairs, guild_id: int | None = None):
+        # active rows for the given (month, day) pairs, served by idx_birthdays_active_month_day
+        sql = f"SELECT * FROM birthdays WHERE ({_month_day_where(len(pairs))})"
+        params = [v for pair in pairs for v in pair]
+        if guild_id is not None:
+            sql += " AND guild_id=?"
+            params.append(guild_id)
+        else:
+            sql += self.shard
+        return await self._read(lambda con: con.execute(sql, params).fetchall())
+
+    @timed_db
+    async def birthdays_in_doy_ranges(self, ranges):
+        # active rows whose day-of-year falls in any of the inclusive (lo, hi) ranges, served by idx_birthdays_active_doy
+        sql = f"SELECT * FROM birthdays WHERE ({' OR '.join(['bday_doy BETWEEN ? AND ? AND active=1'] * len(ranges))}){self.shard}"
+        params = [v for r in ranges for v in r]
+        return await self._read(lambda con: con.execute(sql, params).fetchall())
+
+    @timed_db
+    async def birthdays_for_users(self, guild_id: int, user_ids):
+        sql = f"SELECT * FROM birthdays WHERE guild_id=? AND user_id IN ({_placeholders(len(user_ids))})"
+        return await self._read(lambda con: con.execute(sql, (guild_id, *user_ids)).fetchall())
+
+    @timed_db
+    async def set_birthday_timezone(self, guild_id: int, user_id: int, tz: str):
+        # updated row, or None if the user has no birthday here
+        return await self._write(lambda con: con.execute(SQL_SET_BIRTHDAY_TIMEZONE, (tz, guild_id, user_id)).fetchone())
+
+    @timed_db
+    async def set_guild_active(self, guild_id: int, active: bool):
+        # number of rows that changed
+        cur = await self._write(lambda con: con.execute(SQL_SET_GUILD_ACTIVE, (int(active), guild_id, int(active))))
+        return cur.rowcount
+
+    @timed_db
+    async def set_members_active(self, guild_id: int, user_ids, active: bool):
+        rows = [(int(active), guild_id, user_id, int(active)) for user_id in user_ids]
+        if not rows:
+            return 0
+        cur = await self._write(lambda con: con.executemany(SQL_SET_MEMBER_ACTIVE, rows))
+        return cur.rowcount
+
+    @timed_db
+    async def birthday_guilds(self):
+        # (guild_id, active, total) for every guild with birthdays on this process's shards
+        sql = SQL_BIRTHDAY_GUILDS.format(shard=self.shard)
+        return await self._read(lambda con: con.execute(sql).fetchall())
+
+    @timed_db
+    async def add_birthday(self, guild_id: int, user_id: int, day: int, month: int, tz: str, wish: str | None):
+        # False if the user already has a birthday in this guild
+        cur = await self._write(lambda con: con.execute(SQL_ADD_BIRTHDAY, (guild_id, user_id, day, month, tz, wish)))
+        return cur.rowcount > 0
+
+    @timed_db
+    async def upsert_birthday(self, guild_id: int, user_id: int, day: int, month: int, tz: str, wish: str | None):
+        await self._write(lambda con: con.execute(SQL_UPSERT_BIRTHDAY, (guild_id, user_id, day, month, tz, wish)))
+
+    @timed_db
+    async def upsert_birthdays_many(self, rows):
+        # bulk import: every row in one transaction
+        await self._write(lambda con: con.executemany(SQL_UPSERT_BIRTHDAY, rows))
+
+    @timed_db
+    async def iter_guild_birthdays(self, guild_id: int, fn):
+        # streams rows through fn on the reader thread, never holding the whole guild in memory
+        def run(con):
+            count = 0
+            for row in con.execute(SQL_EXPORT_BIRTHDAYS, (guild_id,)):
+                fn(row)
+                count += 1
+            return count
+        return await self._read(run)
+
+    # ---------------- ANNOUNCE / REMIND MARKERS ----------------
+    # markers are keyed by the user's local date; ticks load them as a set and
+    # write new ones back in one executemany transaction.
+    @timed_db
+    async def announced_keys(self, dates):
+        sql = f"SELECT guild_id, user_id, announce_date FROM bday_announced WHERE announce_date IN ({_placeholders(len(dates))}){self.shard}"
+        rows = await self._read(lambda con: con.execute(sql, list(dates)).fetchall())
+        return {(r[0], r[1], r[2]) for r in rows}
+
+    @timed_db
+    async def mark_announced_many(self, keys):
+        await self._write(lambda con: con.executemany(SQL_MARK_ANNOUNCED, keys))
+
+    @timed_db
+    async def reminded_keys(self, dates):
+        sql = f"SELECT guild_id, user_id, remind_date FROM bday_reminded WHERE remind_date IN ({_placeholders(len(dates))}){self.shard}"
+        rows = await self._read(lambda con: con.execute(sql, list(dates)).fetchall())
+        return {(r[0], r[1], r[2]) for r in rows}
+
+    @timed_db
+    async def mark_reminded_many(self, keys):
+        await self._write(lambda con: con.executemany(SQL_MARK_REMINDED, keys))
+
+    # ---------------- OUTBOX ----------------
+    @timed_db
+    async def enqueue_outbox(self, items, markers, holder: str, ttl: int):
+        # items: (dedup_key, guild_id, kind, users_json, day, created_at, plan_json); one transaction with the
+        # announce markers, so an announcement is either queued durably or not marked at all.
+        # New rows start claimed by `holder` for `ttl` seconds. Returns only the rows that are new.
+        def run(con):
+            rows = [r for item in items for r in con.execute(SQL_ENQUEUE_OUTBOX, (*item, holder, ttl)).fetchall()]
+            con.executemany(SQL_MARK_ANNOUNCED, markers)
+            return rows
+        return await self._write(run)
+
+    @timed_db
+    async def outbox_progress(self, outbox_id: int, step: int, status: str = "pending"):
+        await self._write(lambda con: con.execute(SQL_OUTBOX_PROGRESS, (step, status, outbox_id)))
+
+    @timed_db
+    async def pending_outbox(self, since: int, until: int, limit: int):
+        # created in [since, until) and not claimed by a live process (claims are renewed while sending)
+        sql = SQL_PENDING_OUTBOX.format(shard=self.shard)
+        return await self._read(lambda con: con.execute(sql, (since, until, limit)).fetchall())
+
+    @timed_db
+    async def claim_outbox(self, ids, holder: str, ttl: int):
+        # returns the rows this call claimed; rows another replica got to first are left out
+        def run(con):
+            return [r for outbox_id in ids for r in con.execute(SQL_CLAIM_OUTBOX, (holder, ttl, outbox_id)).fetchall()]
+        return await self._write(run)
+
+    @timed_db
+    async def renew_outbox_claims(self, ids, holder: str, ttl: int):
+        await self._write(lambda con: con.executemany(SQL_RENEW_OUTBOX_CLAIMS, [(ttl, outbox_id, holder) for outbox_id in ids]))
+
+    @timed_db
+    async def expire_outbox(self, before: int):
+        # too old to still be worth sending
+        return await self._write(lambda con: con.execute(SQL_EXPIRE_OUTBOX, (before,)).rowcount)
+
+    # ---------------- LEASES ----------------
+    @timed_db
+    async def acquire_lease(self, name: str, holder: str, ttl: int):
+        # the DB clock decides expiry, so replicas with skewed clocks still agree
+        row = await self._write(lambda con: con.execute(SQL_ACQUIRE_LEASE, (name, holder, ttl)).fetchone())
+        return row is not None
+
+    @timed_db
+    async def release_lease(self, name: str, holder: str):
+        await self._write(lambda con: con.execute(SQL_RELEASE_LEASE, (name, holder)))
+
+    # ---------------- COMPACTION ----------------
+    def _db_bytes(self, con):
+        pages, free, size = (con.execute(f"PRAGMA {p}").fetchone()[0] for p in ("page_count", "freelist_count", "page_size"))
+        wal = os.path.getsize(self.path + "-wal") if os.path.exists(self.path + "-wal") else 0
+        return pages * size, free * size, wal
+
+    @timed_db
+    async def compact_markers(self, cutoff: str, batch: int = 5000):
+        # drop dedup markers (and finished outbox rows) dated before `cutoff` (ISO date), then give the space back:
+        # incremental vacuum returns free pages to the OS, a TRUNCATE checkpoint shrinks the WAL
+        before = await self._write(self._db_bytes)
+        deleted = 0
+        for table, column in MARKER_TABLES:
+            # bounded batches so the writer thread isn't held for one huge transaction
+            sql = f"DELETE FROM {table} WHERE ({column}, guild_id, user_id) IN (SELECT {column}, guild_id, user_id FROM {table} WHERE {column} < ? LIMIT ?)"
+            while True:
+                n = await self._write(lambda con: con.execute(sql, (cutoff, batch)).rowcount)
+                deleted += n
+                if n < batch:
+                    break
+        deleted += await self._write(lambda con: con.execute(SQL_PRUNE_OUTBOX, (cutoff,)).rowcount)
+        # executescript steps the pragma to completion; execute() would free a single page
+        await self._write(lambda con: con.executescript("PRAGMA incremental_vacuum;"))
+        busy = await self._write(lambda con: con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0])
+        after = await self._write(self._db_bytes)
+        return {
+            "deleted": deleted,
+            "file_reclaimed": before[0] - after[0],
+            "wal_reclaimed": before[2] - after[2],
+            "free_pages_bytes": after[1],
+            "checkpoint_busy": bool(busy),
+        }
+
+    # ---------------- ROLE EXPIRY ----------------
+    @timed_db
+    async def add_role_expiry(self, guild_id: int, user_id: int, role_id: int, expires_at: int):
+        await self._write(lambda con: con.execute(SQL_ADD_ROLE_EXPIRY, (guild_id, user_id, role_id, expires_at)))
+
+    @timed_db
+    async def expired_roles(self, now: int, limit: int):
+        sql = SQL_EXPIRED_ROLES.format(shard=self.shard)
+        return await self._read(lambda con: con.execute(sql, (now, limit)).fetchall())
+
+    @timed_db
+    async def delete_role_expiries(self, keys):
+        await self._write(lambda con: con.executemany(SQL_DELETE_ROLE_EXPIRY, keys))